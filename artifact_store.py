@@ -0,0 +1,142 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+ARTIFACT_DB_NAME = "artifacts.sqlite3"
+
+# chunk_start used for artifacts that cover the whole video
+WHOLE_VIDEO = -1.0
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class ArtifactStore:
+    """Work products indexed by (video ID, stage, chunk start) in SQLite.
+
+    Lookups and chronological range reads go through the primary-key index,
+    so they don't depend on how many other videos share the store. Every
+    write is a single transaction.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts ("
+                "video_id TEXT NOT NULL, stage TEXT NOT NULL, "
+                "chunk_start REAL NOT NULL, chunk_end REAL, "
+                "content TEXT NOT NULL, updated REAL NOT NULL, "
+                "PRIMARY KEY (video_id, stage, chunk_start))"
+            )
+
+    @classmethod
+    def for_directory(cls, directory: str) -> "ArtifactStore":
+        db_path = os.path.abspath(os.path.join(directory, ARTIFACT_DB_NAME))
+        with _stores_lock:
+            if db_path not in _stores:
+                _stores[db_path] = cls(db_path)
+            return _stores[db_path]
+
+    def _connect(self):
+        # One connection per operation keeps the store safe to share between
+        # threads; sqlite3 connections are not
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def put(
+        self,
+        video_id: str,
+        stage: str,
+        content: str,
+        chunk_start: float = WHOLE_VIDEO,
+        chunk_end: Optional[float] = None,
+    ):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO artifacts "
+                    "(video_id, stage, chunk_start, chunk_end, content, updated) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (video_id, stage, chunk_start, chunk_end, content, time.time()),
+                )
+        finally:
+            conn.close()
+
+    def delete(self, video_id: str, stage: str, chunk_start: float = WHOLE_VIDEO):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "DELETE FROM artifacts "
+                    "WHERE video_id = ? AND stage = ? AND chunk_start = ?",
+                    (video_id, stage, chunk_start),
+                )
+        finally:
+            conn.close()
+
+    def retain_chunks(self, video_id: str, bounds: List[Tuple[float, float]]):
+        """Delete the video's chunk rows whose (start, end) is not in bounds.
+
+        Rows written under an earlier chunk plan would otherwise be read back
+        alongside the current chunks. Whole-video rows are kept.
+        """
+        keep = set(bounds)
+        conn = self._connect()
+        try:
+            with conn:
+                stale = [
+                    (stage, chunk_start)
+                    for stage, chunk_start, chunk_end in conn.execute(
+                        "SELECT stage, chunk_start, chunk_end FROM artifacts "
+                        "WHERE video_id = ? AND chunk_start != ?",
+                        (video_id, WHOLE_VIDEO),
+                    ).fetchall()
+                    if (chunk_start, chunk_end) not in keep
+                ]
+                conn.executemany(
+                    "DELETE FROM artifacts "
+                    "WHERE video_id = ? AND stage = ? AND chunk_start = ?",
+                    [(video_id, stage, chunk_start) for stage, chunk_start in stale],
+                )
+        finally:
+            conn.close()
+        if stale:
+            print(f"Debug: Removed {len(stale)} artifacts from an earlier chunk plan")
+
+    def get(
+        self, video_id: str, stage: str, chunk_start: float = WHOLE_VIDEO
+    ) -> Optional[str]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT content FROM artifacts "
+                "WHERE video_id = ? AND stage = ? AND chunk_start = ?",
+                (video_id, stage, chunk_start),
+            ).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def range(
+        self,
+        video_id: str,
+        stage: str,
+        start: float = 0.0,
+        end: float = float("inf"),
+    ) -> List[Tuple[float, Optional[float], str]]:
+        """Return (chunk_start, chunk_end, content) rows in chronological order."""
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT chunk_start, chunk_end, content FROM artifacts "
+                "WHERE video_id = ? AND stage = ? AND chunk_start >= ? "
+                "AND chunk_start < ? ORDER BY chunk_start",
+                (video_id, stage, start, end),
+            ).fetchall()
+        finally:
+            conn.close()
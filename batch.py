@@ -0,0 +1,148 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import yt_dlp
+from main import BASE_DIR, run_video, clear_directory
+from models import warm_up_models
+from model_statistics import model_stats
+from run_forecast import format_comparison, merge_forecasts
+from utils import setup_directories
+
+BATCH_DIR = os.path.join(BASE_DIR, "batch")
+
+# Videos processed at the same time. Every video draws on the same Gemini
+# rate limiters, so this mostly overlaps downloads and uploads.
+MAX_CONCURRENT_VIDEOS = 2
+
+
+def read_video_ids(path):
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def playlist_video_ids(playlist_url):
+    ydl_opts = {"extract_flat": True, "quiet": True}
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(playlist_url, download=False)
+    return [entry["id"] for entry in info.get("entries", []) if entry]
+
+
+def process_batch_video(video_id, batch_dir, fresh=False, forecasts=None):
+    # Every video gets its own work directory, so interim files, manifests
+    # and reports from different videos never mix
+    work_dir = os.path.join(batch_dir, video_id)
+    input_dir = os.path.join(work_dir, "input")
+    interim_dir = os.path.join(work_dir, "interim")
+    output_dir = os.path.join(work_dir, "output")
+    setup_directories([input_dir, interim_dir, output_dir])
+    if fresh:
+        for directory in (input_dir, interim_dir, output_dir):
+            clear_directory(directory)
+
+    start_time = time.time()
+    try:
+        report_file = run_video(
+            video_id,
+            input_dir,
+            interim_dir,
+            output_dir,
+            confirm_long=False,
+            forecasts=forecasts,
+        )
+        status = "ok"
+    except Exception as e:
+        print(f"Error processing video {video_id}: {str(e)}")
+        report_file = None
+        status = f"failed: {type(e).__name__}"
+
+    return {
+        "video_id": video_id,
+        "status": status,
+        "duration": time.time() - start_time,
+        "report_file": report_file,
+    }
+
+
+def run_batch(
+    video_ids,
+    batch_dir=BATCH_DIR,
+    max_videos=MAX_CONCURRENT_VIDEOS,
+    fresh=False,
+    forecasts=None,
+):
+    with ThreadPoolExecutor(max_workers=max_videos) as executor:
+        futures = [
+            executor.submit(process_batch_video, video_id, batch_dir, fresh, forecasts)
+            for video_id in video_ids
+        ]
+        return [future.result() for future in futures]
+
+
+def format_summary(results):
+    summary = "Batch Summary:\n\n"
+    summary += f"{'Video ID':<15} {'Status':<30} {'Duration (s)':<15} {'Report':<40}\n"
+    summary += "-" * 100 + "\n"
+    for result in results:
+        summary += f"{result['video_id']:<15} {result['status']:<30} {result['duration']:<15.1f} {result['report_file'] or '-':<40}\n"
+    succeeded = sum(1 for result in results if result["status"] == "ok")
+    summary += f"\n{succeeded}/{len(results)} videos completed\n"
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Analyse many YouTube videos without prompting."
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--ids-file", help="File with one video ID per line")
+    source.add_argument("--playlist", help="YouTube playlist URL")
+    parser.add_argument(
+        "--max-videos",
+        type=int,
+        default=MAX_CONCURRENT_VIDEOS,
+        help="Number of videos processed at the same time",
+    )
+    parser.add_argument(
+        "--batch-dir", default=BATCH_DIR, help="Root of the per-video work directories"
+    )
+    parser.add_argument(
+        "--fresh",
+        action="store_true",
+        help="Clear each video's work directory instead of resuming",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.ids_file:
+        video_ids = read_video_ids(args.ids_file)
+    else:
+        video_ids = playlist_video_ids(args.playlist)
+    print(f"Queued {len(video_ids)} videos")
+
+    warm_up_models()
+    # model_stats is shared by every video of the batch, so forecasts are
+    # compared with it for the batch as a whole
+    forecasts = []
+    results = run_batch(
+        video_ids, args.batch_dir, args.max_videos, args.fresh, forecasts
+    )
+
+    print("\n" + format_summary(results))
+    print("\n" + model_stats.generate_report())
+    if forecasts:
+        print(
+            "\n"
+            + format_comparison(merge_forecasts(forecasts), model_stats.stage_totals())
+        )
+
+    if any(result["status"] != "ok" for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""End-to-end throughput benchmark against the fake Gemini backend.
+
+Runs process_video and generate_final_report over synthetic chunked videos
+of several lengths and reports wall time, model calls per minute and time
+spent waiting on the rate limiters. No quota is used.
+
+    python benchmark.py --lengths 10,30,60 --call-latency 0.5 --rate-scale 10
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+# The backend is chosen when models.py and file_uploader.py are imported,
+# so this has to happen before any pipeline import
+os.environ["GENAI_BACKEND"] = "fake"
+os.environ.setdefault("GEMINI_API_KEY", "fake")
+_bench_dir = tempfile.mkdtemp(prefix="yt_gemini_bench_")
+os.environ.setdefault("RATE_LIMIT_DB", os.path.join(_bench_dir, "rate_limits.sqlite3"))
+os.environ.setdefault("RESPONSE_CACHE_DIR", os.path.join(_bench_dir, "responses"))
+os.environ.setdefault("UPLOAD_CACHE_DB", os.path.join(_bench_dir, "uploads.sqlite3"))
+
+import fake_genai  # noqa: E402
+from models import GEMINI_FLASH_LIMITER, GEMINI_PRO_LIMITER  # noqa: E402
+from model_statistics import model_stats  # noqa: E402
+from response_cache import response_cache  # noqa: E402
+from utils import TimedTranscript, setup_directories  # noqa: E402
+from video_processor import process_video  # noqa: E402
+from chunk_planner import plan_chunks  # noqa: E402
+from tracing import tracer  # noqa: E402
+from model_router import model_router  # noqa: E402
+from run_forecast import forecast_run, format_comparison  # noqa: E402
+from final_report_generator import generate_final_report  # noqa: E402
+
+WORDS_PER_SECOND = 2.5
+
+
+def make_synthetic_video(work_dir, minutes, chunk_plan, chunk_bytes):
+    input_dir = os.path.join(work_dir, "input")
+    setup_directories([input_dir])
+    chunks = []
+    for start, end in chunk_plan:
+        path = os.path.join(
+            input_dir, f"synthetic_chunk_{start // 60:03.0f}-{end // 60:03.0f}.mp4"
+        )
+        with open(path, "wb") as f:
+            f.write(os.urandom(chunk_bytes))
+        fake_genai.settings.video_seconds[os.path.basename(path)] = end - start
+        chunks.append((path, start, end))
+
+    entries = [
+        {"start": float(second), "duration": 4.0, "text": "word " * 10}
+        for second in range(0, minutes * 60, int(10 / WORDS_PER_SECOND))
+    ]
+    return chunks, TimedTranscript(entries)
+
+
+def run_benchmark(minutes, args):
+    fake_genai.reset(args.seed)
+    model_stats.reset()
+    tracer.reset()
+    model_router.reset()
+    work_dir = tempfile.mkdtemp(prefix=f"video_{minutes}m_", dir=_bench_dir)
+    interim_dir = os.path.join(work_dir, "interim")
+    output_dir = os.path.join(work_dir, "output")
+    setup_directories([interim_dir, output_dir])
+    chunk_plan = plan_chunks(
+        minutes * 60,
+        args.chunk_minutes * 60 if args.chunk_minutes else None,
+        parallelism=args.chunk_workers,
+    )
+    chunks, transcript = make_synthetic_video(
+        work_dir, minutes, chunk_plan, int(args.chunk_mb * 1024 * 1024)
+    )
+
+    video_id = f"bench{minutes}"
+    title = f"Synthetic {minutes} minute video"
+    start_time = time.time()
+    process_video(
+        chunks,
+        video_id,
+        title,
+        chunk_plan,
+        max_workers=args.chunk_workers,
+        interim_dir=interim_dir,
+        transcript=transcript,
+        fused=args.fused,
+    )
+    analysis_done = time.time()
+    generate_final_report(
+        title,
+        video_id,
+        interim_dir=interim_dir,
+        output_dir=output_dir,
+        chunk_plan=chunk_plan,
+    )
+    end_time = time.time()
+    if args.forecast:
+        forecast = forecast_run(
+            minutes * 60, transcript.char_count, chunk_plan, fused=args.fused
+        )
+        print("\n" + format_comparison(forecast, model_stats.stage_totals()))
+    if args.trace:
+        print("\n" + model_router.format_report())
+        print("\n" + tracer.format_summary())
+        tracer.export_chrome_trace(os.path.join(work_dir, "trace.json"))
+
+    calls = fake_genai.counters["generate_content"]
+    wall_time = end_time - start_time
+    return {
+        "minutes": minutes,
+        "chunks": len(chunks),
+        "wall_time": wall_time,
+        "analysis_time": analysis_done - start_time,
+        "report_time": end_time - analysis_done,
+        "calls": calls,
+        "calls_per_minute": calls / wall_time * 60 if wall_time else 0.0,
+        "limiter_wait": sum(
+            waits["total_wait"] for waits in model_stats.limiter_waits.values()
+        ),
+        "rate_limited": fake_genai.counters["rate_limited"],
+        "cache_hits": model_stats.cache_hits,
+    }
+
+
+def format_results(results):
+    report = "Benchmark Results:\n\n"
+    report += f"{'Video (min)':<12} {'Chunks':<8} {'Wall (s)':<10} {'Analysis (s)':<14} {'Report (s)':<12} {'Calls':<7} {'Calls/min':<11} {'Limiter wait (s)':<18} {'429s':<6} {'Cache hits':<10}\n"
+    report += "-" * 115 + "\n"
+    for r in results:
+        report += f"{r['minutes']:<12} {r['chunks']:<8} {r['wall_time']:<10.2f} {r['analysis_time']:<14.2f} {r['report_time']:<12.2f} {r['calls']:<7} {r['calls_per_minute']:<11.1f} {r['limiter_wait']:<18.2f} {r['rate_limited']:<6} {r['cache_hits']:<10}\n"
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--lengths", default="10,30,60", help="Comma-separated video lengths in minutes"
+    )
+    parser.add_argument("--chunk-workers", type=int, default=4)
+    parser.add_argument(
+        "--chunk-minutes",
+        type=float,
+        help="Use fixed-length chunks instead of the planned length",
+    )
+    parser.add_argument(
+        "--chunk-mb", type=float, default=1.0, help="Size of each synthetic chunk"
+    )
+    parser.add_argument("--call-latency", type=float, default=0.5)
+    parser.add_argument("--processing-seconds", type=float, default=2.0)
+    parser.add_argument("--rate-limit-error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-json-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--rate-scale",
+        type=float,
+        default=1.0,
+        help="Multiply the Flash and Pro RPM/TPM budgets, e.g. 10 to shorten runs",
+    )
+    parser.add_argument(
+        "--use-cache",
+        action="store_true",
+        help="Keep the response cache on (off by default so every call is sent)",
+    )
+    parser.add_argument(
+        "--fused",
+        action="store_true",
+        help="Analyse each chunk with one fused request instead of four",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Print per-stage latency and write trace.json into each work directory",
+    )
+    parser.add_argument(
+        "--forecast",
+        action="store_true",
+        help="Print the dry-run forecast next to the recorded calls and tokens",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    fake_genai.settings.call_latency = args.call_latency
+    fake_genai.settings.processing_seconds = args.processing_seconds
+    fake_genai.settings.rate_limit_error_rate = args.rate_limit_error_rate
+    fake_genai.settings.malformed_json_rate = args.malformed_json_rate
+    response_cache.bypass = not args.use_cache
+    for limiter in (GEMINI_FLASH_LIMITER, GEMINI_PRO_LIMITER):
+        limiter.requests_per_minute *= args.rate_scale
+        limiter.tokens_per_minute *= args.rate_scale
+
+    results = [run_benchmark(int(minutes), args) for minutes in args.lengths.split(",")]
+    print("\n" + format_results(results))
+    print(f"Work directories kept under {_bench_dir}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
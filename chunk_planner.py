@@ -0,0 +1,68 @@
+import math
+from typing import List, Tuple
+from models import GEMINI_FLASH_LIMITER, GEMINI_FLASH_MODEL, MODEL_INPUT_TOKEN_LIMITS
+from token_budget import VIDEO_TOKENS_PER_SECOND
+
+# Bounds on planned chunk length. Short chunks waste calls on fixed prompt
+# overhead; long ones make a single failed call expensive to redo.
+MIN_CHUNK_SECONDS = 5 * 60
+MAX_CHUNK_SECONDS = 45 * 60
+
+# Share of the model's context window a chunk's video may take, leaving room
+# for the prompt and the response
+CONTEXT_FRACTION = 0.5
+
+
+def plan_chunk_duration(
+    duration_seconds: float,
+    context_tokens: int = None,
+    tokens_per_minute: int = None,
+    parallelism: int = 4,
+) -> int:
+    """Pick a chunk length in whole seconds.
+
+    The length aims to give every one of `parallelism` workers a chunk. It
+    is capped so one chunk fits the context window, and so that `parallelism`
+    chunks in flight at once fit the per-minute token budget. The limits
+    default to those of the Flash model that analyses the chunks.
+    """
+    if context_tokens is None:
+        context_tokens = MODEL_INPUT_TOKEN_LIMITS[GEMINI_FLASH_MODEL]
+    if tokens_per_minute is None:
+        tokens_per_minute = GEMINI_FLASH_LIMITER.tokens_per_minute
+
+    by_context = context_tokens * CONTEXT_FRACTION / VIDEO_TOKENS_PER_SECOND
+    by_tokens_per_minute = tokens_per_minute / parallelism / VIDEO_TOKENS_PER_SECOND
+    by_parallelism = duration_seconds / parallelism
+
+    chunk_seconds = min(by_parallelism, by_context, by_tokens_per_minute)
+    chunk_seconds = min(max(chunk_seconds, MIN_CHUNK_SECONDS), MAX_CHUNK_SECONDS)
+
+    # Spread the video evenly so the last chunk is not a short remainder,
+    # using one chunk fewer if that would make them shorter than the minimum
+    chunk_count = max(math.ceil(duration_seconds / chunk_seconds), 1)
+    if chunk_count > 1 and duration_seconds / chunk_count < MIN_CHUNK_SECONDS:
+        chunk_count -= 1
+    return math.ceil(duration_seconds / chunk_count)
+
+
+def fixed_chunk_plan(
+    duration_seconds: float, chunk_seconds: float
+) -> List[Tuple[float, float]]:
+    return [
+        (float(start), float(min(start + chunk_seconds, duration_seconds)))
+        for start in range(0, math.ceil(duration_seconds), int(chunk_seconds))
+    ]
+
+
+def plan_chunks(
+    duration_seconds: float, chunk_seconds: float = None, **limits
+) -> List[Tuple[float, float]]:
+    """Return (start, end) chunk boundaries in seconds.
+
+    chunk_seconds forces a fixed length; otherwise plan_chunk_duration picks
+    one from the video length and `limits`.
+    """
+    if chunk_seconds is None:
+        chunk_seconds = plan_chunk_duration(duration_seconds, **limits)
+    return fixed_chunk_plan(duration_seconds, chunk_seconds)
@@ -1,65 +1,176 @@
 import time
 import os
+import json
 from datetime import datetime
-from models import get_gemini_flash_model_json, get_gemini_flash_model_text
+from models import (
+    get_gemini_flash_model_json,
+    get_gemini_flash_model_text,
+    send_request,
+)
+from model_statistics import record_model_call
+from token_budget import (
+    TRANSCRIPT_TOKEN_BUDGET,
+    estimate_tokens,
+    trim_to_budget,
+)
+from error_handling import TokenBudgetError
+from artifact_store import ArtifactStore
+from structured_elements import (
+    STRUCTURED_ELEMENTS_SCHEMA,
+    parse_structured_elements,
+    offset_timestamps,
+)
+from prompt_logic_intertextual import REFERENCE_SCHEMA
+
+INTERIM_DIR = "./interim"
+
+# Tag used for each work product type in interim file names
+WORK_PRODUCT_FILE_TAGS = {
+    "video_analysis": "video",
+    "transcript_analysis": "transcript",
+    "intertextual_analysis": "intertextual",
+    "summary": "summary",
+    "error": "error",
+}
+
+# generate_content returns failures as text starting with this prefix
+ANALYSIS_ERROR_PREFIX = "Error in analysis:"
+
+# Work products produced by one fused per-chunk request, in the order
+# process_chunk saves them
+FUSED_WORK_PRODUCT_TYPES = [
+    "video_analysis",
+    "transcript_analysis",
+    "intertextual_analysis",
+    "summary",
+]
 
+FUSED_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "structured_elements": STRUCTURED_ELEMENTS_SCHEMA["properties"][
+            "structured_elements"
+        ],
+        "transcript_analysis": {"type": "string"},
+        "intertextual_references": {"type": "array", "items": REFERENCE_SCHEMA},
+        "summary": {"type": "string"},
+    },
+    "required": [
+        "structured_elements",
+        "transcript_analysis",
+        "intertextual_references",
+        "summary",
+    ],
+}
+
+
+def generate_content(
+    prompt,
+    video_file=None,
+    use_json=False,
+    stage=None,
+    parts=None,
+    response_schema=None,
+    validate=None,
+    on_text=None,
+    file_seconds=None,
+):
+    # parts are extra content parts, such as inline images, sent before the
+    # prompt. validate raises ValueError on a response that should be retried.
+    # on_text streams the response, see send_request. file_seconds is the
+    # length of video_file, which its token estimate is based on.
+    @record_model_call(stage=stage)
+    def call_model(model, contents, refresh):
+        return send_request(
+            model,
+            contents,
+            refresh=refresh,
+            on_text=on_text,
+            file_seconds=file_seconds,
+        )
 
-def generate_content(prompt, video_file=None, use_json=False):
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            estimated_tokens = len(prompt) // 4
-            if video_file:
-                estimated_tokens += 1000  # Placeholder estimate for video file
-            print(f"Estimated tokens for this call: {estimated_tokens}")
+            contents = [video_file, prompt] if video_file else prompt
+            if parts:
+                contents = parts + [prompt]
+            print(
+                f"Estimated tokens for this call: {estimate_tokens(contents, file_seconds)}"
+            )
 
             model = (
-                get_gemini_flash_model_json()
+                get_gemini_flash_model_json(response_schema)
                 if use_json
                 else get_gemini_flash_model_text()
             )
 
-            if video_file:
-                response = model.generate_content([video_file, prompt])
-            else:
-                response = model.generate_content(prompt)
+            response = call_model(model, contents, attempt > 0)
 
             if response.prompt_feedback:
                 print(f"Prompt feedback: {response.prompt_feedback}")
 
             if not response.text:
                 raise ValueError("Response was blocked or empty. Check safety ratings.")
+            if validate:
+                validate(response.text)
 
             return response.text
 
+        except TokenBudgetError:
+            # Retrying the same oversized request cannot succeed
+            raise
         except Exception as e:
             print(f"Error generating content (attempt {attempt + 1}): {str(e)}")
             if attempt == max_retries - 1:
-                return f"Error in analysis: {str(e)}"
+                return f"{ANALYSIS_ERROR_PREFIX} {str(e)}"
             time.sleep(2**attempt)  # Exponential backoff
 
 
-def analyze_video_content(video_file, chunk_start, chunk_end):
+def analyze_video_content(
+    video_file, chunk_start, chunk_end, keyframe_parts=None, on_text=None
+):
+    # With keyframe_parts the model sees the distinct frames of the chunk
+    # instead of the uploaded video_file
+    source = (
+        "the video frames above, each labelled with its timestamp. Consecutive near-identical frames have been removed, so each frame is a distinct view"
+        if keyframe_parts
+        else "the video"
+    )
     prompt = f"""
-    Analyze the visual content of the video for the chunk from {chunk_start} to {chunk_end} minutes, focusing on structured presentation elements such as slides, graphs, charts, code snippets, or any organized text/visual information.
+    Analyze the visual content of {source} for the chunk from {chunk_start:.1f} to {chunk_end:.1f} minutes, focusing on structured presentation elements such as slides, graphs, charts, code snippets, or any organized text/visual information.
 
-    For each structured element you identify:
-    1. Describe the type of element (e.g., slide, graph, chart, code snippet).
-    2. Provide the timestamp or time range when it appears.
-    3. Recreate the content of the element as accurately as possible, including:
+    For each structured element you identify, return an object with:
+    1. element_type: one of slide, graph, chart, diagram, table, code_snippet, other.
+    2. timestamp: when it first appears, as MM:SS from the start of this chunk.
+    3. content: the element recreated as accurately as possible, starting with a one-line title:
        - For slides: Reproduce the text, bullet points, and describe any images.
        - For graphs/charts: Describe the type of graph, axes labels, data points, and trends.
        - For code snippets: Reproduce the code as exactly as possible.
        - For other structured elements: Provide a detailed description or reproduction.
 
-    Format your response in Markdown, using appropriate headings, subheadings, and formatting to recreate the structured elements as closely as possible.
+    Return a JSON object with a "structured_elements" array of these objects, in order of appearance. List an element again only if its content changes.
     """
-    return generate_content(prompt, video_file, use_json=False)
-
-
-def analyze_transcript(transcript, chunk_start, chunk_end):
+    analysis = generate_content(
+        prompt,
+        video_file,
+        use_json=True,
+        stage="video_analysis",
+        parts=keyframe_parts,
+        response_schema=STRUCTURED_ELEMENTS_SCHEMA,
+        validate=parse_structured_elements,
+        on_text=on_text,
+        file_seconds=(chunk_end - chunk_start) * 60,
+    )
+    if analysis.startswith(ANALYSIS_ERROR_PREFIX):
+        return analysis
+    return offset_timestamps(analysis, chunk_start * 60)
+
+
+def analyze_transcript(transcript, chunk_start, chunk_end, on_text=None):
+    transcript = trim_to_budget(transcript, TRANSCRIPT_TOKEN_BUDGET)
     prompt = f"""
-    Analyze the following transcript content for the chunk from {chunk_start} to {chunk_end} minutes:
+    Analyze the following transcript content for the chunk from {chunk_start:.1f} to {chunk_end:.1f} minutes:
 
     Transcript: {transcript}
 
@@ -71,7 +182,9 @@ def analyze_transcript(transcript, chunk_start, chunk_end):
 
     Format your response in Markdown, using appropriate headings, subheadings, and bullet points.
     """
-    return generate_content(prompt, use_json=False)
+    return generate_content(
+        prompt, use_json=False, stage="transcript_analysis", on_text=on_text
+    )
 
 
 # ... (rest of the file remains unchanged)
@@ -85,9 +198,10 @@ def analyze_combined_video_and_transcript_wp(
     chunk_end,
     video_id,
     video_title,
+    on_text=None,
 ):
     prompt = f"""
-    Analyze the following video content, transcript, and intertextual analysis for the 10-minute chunk from {chunk_start} to {chunk_end} minutes:
+    Analyze the following video content, transcript, and intertextual analysis for the chunk from {chunk_start:.1f} to {chunk_end:.1f} minutes:
 
     Video Analysis (Structured Elements):
     {video_analysis}
@@ -109,39 +223,121 @@ def analyze_combined_video_and_transcript_wp(
     Ensure that each structured visual element is clearly presented and explained in the context of the spoken content and any relevant intertextual references.
     """
 
-    return generate_content(prompt)
+    return generate_content(prompt, stage="summary", on_text=on_text)
+
+
+def parse_fused_analysis(text):
+    """Split a fused analysis into its work products, or raise ValueError."""
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Fused analysis is not valid JSON: {str(e)}")
+    if not isinstance(parsed, dict):
+        raise ValueError("Fused analysis is not a JSON object")
+    for field in ("transcript_analysis", "summary"):
+        if not isinstance(parsed.get(field), str) or not parsed[field].strip():
+            raise ValueError(f"Fused analysis has no {field}")
+    references = parsed.get("intertextual_references")
+    if not isinstance(references, list):
+        raise ValueError("Fused analysis has no intertextual_references array")
+
+    video_analysis = json.dumps(
+        {"structured_elements": parsed.get("structured_elements")}, indent=2
+    )
+    parse_structured_elements(video_analysis)
+    return {
+        "video_analysis": video_analysis,
+        "transcript_analysis": parsed["transcript_analysis"],
+        "intertextual_analysis": json.dumps({"references": references}, indent=2),
+        "summary": parsed["summary"],
+    }
+
+
+def analyze_chunk_fused(
+    video_file, transcript, chunk_start, chunk_end, keyframe_parts=None, on_text=None
+):
+    """Produce all four work products of a chunk in one request.
+
+    The video (or keyframe_parts) and the transcript are sent once, instead
+    of earlier outputs being re-sent to the intertextual and summary calls.
+    Returns a dict keyed by FUSED_WORK_PRODUCT_TYPES; on failure every entry
+    is the error text.
+    """
+    transcript = trim_to_budget(transcript, TRANSCRIPT_TOKEN_BUDGET)
+    source = "the video frames above" if keyframe_parts else "the video"
+    prompt = f"""
+    Analyze {source} and the transcript below for the chunk from {chunk_start:.1f} to {chunk_end:.1f} minutes.
 
+    Transcript: {transcript}
 
-def save_interim_work_product(content, video_id, video_title, analysis_type):
+    Return a JSON object with these fields:
+    1. structured_elements: the structured presentation elements shown (slides, graphs, charts, diagrams, tables, code snippets), in order of appearance. For each give element_type, timestamp (MM:SS from the start of this chunk) and content, the element recreated as accurately as possible starting with a one-line title. List an element again only if its content changes.
+    2. transcript_analysis: a Markdown analysis of the spoken content covering key points, notable quotes, speakers or people mentioned, and significant topics or themes.
+    3. intertextual_references: references to literary works, philosophical concepts, historical events, scientific theories, pop culture, AI technology, research papers, internet culture or other notable ideas. For each give type (literary/philosophical/historical/scientific/pop_culture/ai_tech/research/internet_culture/other), reference, context (how it was used), explanation and significance.
+    4. summary: a Markdown report synthesizing the above, with a chronological list of the structured elements and their relevance to the spoken content, the key points and quotes linked to the visual elements, the significance of the intertextual references, and the overall flow of the segment.
+    """
+    text = generate_content(
+        prompt,
+        video_file,
+        use_json=True,
+        stage="fused_analysis",
+        parts=keyframe_parts,
+        response_schema=FUSED_ANALYSIS_SCHEMA,
+        validate=parse_fused_analysis,
+        on_text=on_text,
+        file_seconds=(chunk_end - chunk_start) * 60,
+    )
+    if text.startswith(ANALYSIS_ERROR_PREFIX):
+        return {wp_type: text for wp_type in FUSED_WORK_PRODUCT_TYPES}
+    work_products = parse_fused_analysis(text)
+    work_products["video_analysis"] = offset_timestamps(
+        work_products["video_analysis"], chunk_start * 60
+    )
+    return work_products
+
+
+def save_interim_work_product(
+    content,
+    video_id,
+    video_title,
+    work_product_type,
+    chunk_start=None,
+    chunk_end=None,
+    interim_dir=INTERIM_DIR,
+):
     print(f"Debug: Entering save_interim_work_product function")
     print(f"Debug: content length = {len(content)}")
     print(f"Debug: video_id = {video_id}")
     print(f"Debug: video_title = {video_title}")
-    print(f"Debug: analysis_type = {analysis_type}")
+    print(f"Debug: work_product_type = {work_product_type}")
 
-    shortened_title = "".join(e for e in video_title if e.isalnum())[:20]
+    store = ArtifactStore.for_directory(interim_dir)
+    if chunk_start is None:
+        store.put(video_id, work_product_type, content)
+    else:
+        store.put(video_id, work_product_type, content, chunk_start, chunk_end)
 
-    if "chunk" in analysis_type:
-        chunk_info = analysis_type.split("chunk_")[1]
-        chunk_start, chunk_end = chunk_info.split("_")
-        chunk_start = float(chunk_start)
-        chunk_end = float(chunk_end)
-        filename = f"wp_{shortened_title}_{analysis_type.split('_')[0]}_chunk_{int(chunk_start):03d}_{int(chunk_end):03d}.txt"
+    # A readable copy is still written next to the store
+    shortened_title = "".join(e for e in video_title if e.isalnum())[:20]
+    file_tag = WORK_PRODUCT_FILE_TAGS.get(work_product_type, work_product_type)
+    if chunk_start is not None:
+        filename = f"wp_{shortened_title}_{file_tag}_chunk_{int(chunk_start):03d}_{int(chunk_end):03d}.txt"
     else:
-        filename = f"wp_{shortened_title}_{analysis_type}.txt"
+        filename = f"wp_{shortened_title}_{file_tag}.txt"
 
-    interim_dir = "./interim"
     os.makedirs(interim_dir, exist_ok=True)
 
     file_path = os.path.join(interim_dir, filename)
     with open(file_path, "w", encoding="utf-8") as f:
         f.write(content)
 
-    print(f"Saved {analysis_type} interim work product: {filename}")
+    print(f"Saved {work_product_type} interim work product: {filename}")
     return filename
 
 
 __all__ = [
+    "INTERIM_DIR",
+    "ANALYSIS_ERROR_PREFIX",
     "generate_content",
     "analyze_video_content",
     "analyze_transcript",
@@ -4,6 +4,12 @@ class VideoProcessingError(Exception):
     pass
 
 
+class TokenBudgetError(VideoProcessingError):
+    """Raised when a request's input exceeds its token budget."""
+
+    pass
+
+
 def handle_exceptions(func):
     def wrapper(*args, **kwargs):
         try:
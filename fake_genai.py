@@ -0,0 +1,251 @@
+"""Local stand-in for the parts of google.generativeai this project uses.
+
+Files move from PROCESSING to ACTIVE after a configurable delay, model calls
+sleep for a configurable latency and report usage metadata, and 429s or
+malformed JSON can be injected at a given rate. Select it with
+GENAI_BACKEND=fake and tune it through `settings`.
+"""
+
+import datetime
+import enum
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+
+class FakeSettings:
+    def __init__(self):
+        self.upload_seconds_per_mb = 0.05
+        self.processing_seconds = 2.0
+        self.call_latency = 0.5
+        self.seconds_per_1k_output_tokens = 0.1
+        self.output_tokens = 400
+        self.rate_limit_error_rate = 0.0
+        self.malformed_json_rate = 0.0
+        self.file_tokens = 10 * 60 * 263
+        # Seconds of video per uploaded file name; others bill file_tokens
+        self.video_seconds = {}
+        self.seed = None
+
+
+settings = FakeSettings()
+
+_lock = threading.Lock()
+_files = {}
+_file_ids = itertools.count()
+_random = random.Random()
+
+counters = {"uploads": 0, "get_file": 0, "generate_content": 0, "rate_limited": 0}
+
+
+def reset(seed=None):
+    with _lock:
+        _files.clear()
+        for key in counters:
+            counters[key] = 0
+        _random.seed(seed if seed is not None else settings.seed)
+
+
+def _count(key):
+    with _lock:
+        counters[key] += 1
+
+
+class HarmCategory(enum.Enum):
+    HARM_CATEGORY_HARASSMENT = 7
+    HARM_CATEGORY_HATE_SPEECH = 8
+    HARM_CATEGORY_SEXUALLY_EXPLICIT = 9
+    HARM_CATEGORY_DANGEROUS_CONTENT = 10
+
+
+class HarmBlockThreshold(enum.Enum):
+    BLOCK_NONE = 4
+
+
+types = SimpleNamespace(
+    HarmCategory=HarmCategory, HarmBlockThreshold=HarmBlockThreshold
+)
+
+
+class ResourceExhausted(Exception):
+    """Mimics google.api_core.exceptions.ResourceExhausted."""
+
+    code = 429
+
+
+def configure(api_key=None, **kwargs):
+    pass
+
+
+class _State:
+    def __init__(self, name):
+        self.name = name
+
+
+class File:
+    def __init__(self, name, display_name, size, ready_at, tokens):
+        self.name = name
+        self.display_name = display_name
+        self.uri = f"https://fake.local/v1beta/{name}"
+        self.size_bytes = size
+        self.ready_at = ready_at
+        self.tokens = tokens
+        self.expiration_time = datetime.datetime.now(
+            datetime.timezone.utc
+        ) + datetime.timedelta(hours=48)
+        self.failed = False
+
+    @property
+    def state(self):
+        if self.failed:
+            return _State("FAILED")
+        return _State("ACTIVE" if time.time() >= self.ready_at else "PROCESSING")
+
+
+def upload_file(path, display_name=None, **kwargs):
+    size = os.path.getsize(path)
+    time.sleep(settings.upload_seconds_per_mb * size / (1024 * 1024))
+    _count("uploads")
+    with _lock:
+        name = f"files/fake-{next(_file_ids):06d}"
+        seconds = settings.video_seconds.get(os.path.basename(path))
+        video_file = File(
+            name,
+            display_name,
+            size,
+            time.time() + settings.processing_seconds,
+            settings.file_tokens if seconds is None else int(seconds * 263),
+        )
+        _files[name] = video_file
+    return video_file
+
+
+def get_file(name):
+    _count("get_file")
+    with _lock:
+        if name not in _files:
+            raise KeyError(f"File {name} not found")
+        return _files[name]
+
+
+def get_model(name):
+    return SimpleNamespace(name=name)
+
+
+def _estimate_tokens(contents):
+    parts = contents if isinstance(contents, list) else [contents]
+    tokens = 0
+    for part in parts:
+        if isinstance(part, str):
+            tokens += len(part) // 4
+        elif isinstance(part, File):
+            tokens += part.tokens
+        else:
+            tokens += 258  # Inline images are billed at a flat rate
+    return tokens
+
+
+def _sample_from_schema(schema):
+    schema_type = str(schema.get("type", "string")).lower()
+    if schema_type == "object":
+        return {
+            key: _sample_from_schema(value)
+            for key, value in schema.get("properties", {}).items()
+        }
+    if schema_type == "array":
+        return [_sample_from_schema(schema.get("items", {})) for _ in range(3)]
+    if schema_type in ("integer", "number"):
+        return _random.randint(0, 600)
+    if "enum" in schema:
+        return _random.choice(schema["enum"])
+    return f"fake text {_random.randint(0, 10**6)}"
+
+
+def _fake_text(output_tokens):
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "forcing", "function"]
+    body = " ".join(_random.choice(words) for _ in range(output_tokens))
+    return f"## Fake analysis\n\n{body}\n"
+
+
+def _fake_json(schema):
+    if schema:
+        return json.dumps(_sample_from_schema(schema))
+    return json.dumps(
+        [
+            {
+                "type": "other",
+                "reference": f"Reference {_random.randint(0, 50)}",
+                "context": "fake context",
+                "explanation": "fake explanation",
+                "significance": "fake significance",
+            }
+            for _ in range(3)
+        ]
+    )
+
+
+class GenerateContentResponse:
+    def __init__(self, text, prompt_tokens, piece_delay=0.0):
+        self.text = text
+        self.piece_delay = piece_delay
+        self.prompt_feedback = None
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=len(text) // 4,
+            total_token_count=prompt_tokens + len(text) // 4,
+        )
+
+    def __iter__(self):
+        # Streaming responses yield the text in a few pieces
+        step = max(len(self.text) // 4, 1)
+        for start in range(0, len(self.text), step):
+            time.sleep(self.piece_delay)
+            yield SimpleNamespace(text=self.text[start : start + step])
+
+    def resolve(self):
+        pass
+
+
+class GenerativeModel:
+    def __init__(self, model_name, generation_config=None, safety_settings=None):
+        self.model_name = (
+            model_name if model_name.startswith("models/") else f"models/{model_name}"
+        )
+        self._generation_config = dict(generation_config or {})
+        self._safety_settings = safety_settings
+
+    def count_tokens(self, contents):
+        return SimpleNamespace(total_tokens=_estimate_tokens(contents))
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        _count("generate_content")
+        with _lock:
+            rate_limited = _random.random() < settings.rate_limit_error_rate
+            malformed = _random.random() < settings.malformed_json_rate
+        if rate_limited:
+            _count("rate_limited")
+            time.sleep(settings.call_latency / 10)
+            raise ResourceExhausted("429 Resource has been exhausted (fake)")
+
+        config = self._generation_config
+        if config.get("response_mime_type") == "application/json":
+            text = _fake_json(config.get("response_schema"))
+            if malformed:
+                text = text[: len(text) // 2]
+        else:
+            text = _fake_text(settings.output_tokens)
+
+        # A streamed response arrives after call_latency and then piece by
+        # piece while the output is generated
+        generation_time = settings.seconds_per_1k_output_tokens * (len(text) / 4) / 1000
+        if stream:
+            time.sleep(settings.call_latency)
+            return GenerateContentResponse(
+                text, _estimate_tokens(contents), piece_delay=generation_time / 4
+            )
+        time.sleep(settings.call_latency + generation_time)
+        return GenerateContentResponse(text, _estimate_tokens(contents))
@@ -1,6 +1,13 @@
-import google.generativeai as genai
+from gemini_client import genai
+import random
+import threading
 import time
 import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from response_cache import response_cache, sha256_file, sha256_text
+from proxy_transcode import PROXY_PRESET, make_proxy
+from upload_cache import upload_cache
+from tracing import tracer
 
 # Configure Gemini API
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
@@ -8,21 +15,217 @@ if not GEMINI_API_KEY:
     raise ValueError("GEMINI_API_KEY not found in .env file")
 genai.configure(api_key=GEMINI_API_KEY)
 
+MAX_CONCURRENT_UPLOADS = 4
 
-def upload_video(video_path):
+# Polling schedule for files in the PROCESSING state: start short, back off
+# geometrically up to a cap, and jitter each delay so parallel uploads don't
+# hit get_file in lockstep.
+POLL_INITIAL_DELAY = 1.0
+POLL_MAX_DELAY = 10.0
+POLL_BACKOFF = 1.5
+POLL_JITTER = 0.2
+
+
+def next_poll_delay(delay):
+    return min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+
+
+def jittered(delay):
+    return delay * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+
+def upload_video(video_path, content_hash=None):
     print(f"Uploading file...")
-    video_file = genai.upload_file(path=video_path)
+    with tracer.span(
+        "upload", "upload", path=video_path, bytes=os.path.getsize(video_path)
+    ):
+        video_file = genai.upload_file(path=video_path)
     print(f"Completed upload: {video_file.uri}")
+    response_cache.register_file(
+        video_file.name, content_hash or sha256_file(video_path)
+    )
     return video_file
 
 
+@tracer.traced("wait_for_file_active", "upload")
 def wait_for_file_active(video_file):
+    delay = POLL_INITIAL_DELAY
     while video_file.state.name == "PROCESSING":
-        print(".", end="")
-        time.sleep(10)
+        print(".", end="", flush=True)
+        time.sleep(jittered(delay))
+        delay = next_poll_delay(delay)
         video_file = genai.get_file(video_file.name)
 
     if video_file.state.name == "FAILED":
         raise ValueError(f"File processing failed: {video_file.state.name}")
 
     return video_file
+
+
+class UploadManager:
+    """Uploads files in parallel and polls all PROCESSING files from one thread.
+
+    submit() returns a Future that resolves to the ACTIVE file, so callers can
+    start analysing each chunk as soon as its own file is ready. With a
+    proxy_preset each file is transcoded to a small proxy before upload.
+    """
+
+    def __init__(self, max_workers=MAX_CONCURRENT_UPLOADS, proxy_preset=PROXY_PRESET):
+        self.proxy_preset = proxy_preset
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.states = {}
+        self.condition = threading.Condition()
+        self.pending = {}
+        # Remote name -> when the file was first seen PROCESSING
+        self.processing_since = {}
+        self.closed = False
+        self.poller = threading.Thread(target=self._poll_loop, daemon=True)
+        self.poller.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, video_path, remote_name=None):
+        """Upload video_path, or reuse remote_name if it is still on the service."""
+        future = Future()
+        self._set_state(video_path, "QUEUED")
+        self.executor.submit(self._upload, video_path, future, remote_name)
+        return future
+
+    def state_counts(self):
+        with self.condition:
+            counts = {}
+            for state in self.states.values():
+                counts[state] = counts.get(state, 0) + 1
+            return counts
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self.condition:
+            while self.pending:
+                self.condition.wait()
+            self.closed = True
+            self.condition.notify_all()
+        self.poller.join()
+
+    def _set_state(self, video_path, state):
+        with self.condition:
+            self.states[video_path] = state
+
+    def _content_hash(self, video_path):
+        # Responses for a proxy must not be mixed up with the original's
+        content_hash = sha256_file(video_path)
+        if self.proxy_preset:
+            content_hash = sha256_text(f"proxy:{self.proxy_preset}:{content_hash}")
+        return content_hash
+
+    def _reuse(self, remote_name, content_hash):
+        try:
+            video_file = genai.get_file(remote_name)
+        except Exception as e:
+            print(f"Cannot reuse {remote_name}, uploading again: {str(e)}")
+            return None
+        if video_file.state.name == "FAILED":
+            return None
+        print(f"Reusing uploaded file: {video_file.uri}")
+        response_cache.register_file(video_file.name, content_hash)
+        return video_file
+
+    def _upload(self, video_path, future, remote_name=None):
+        try:
+            # Reuse the file an earlier run of this video uploaded, or any
+            # upload of the same content that is still on the service
+            content_hash = self._content_hash(video_path)
+            video_file = None
+            if remote_name:
+                video_file = self._reuse(remote_name, content_hash)
+            if video_file is None:
+                cached_name = upload_cache.get(content_hash)
+                if cached_name:
+                    video_file = self._reuse(cached_name, content_hash)
+                    if video_file is None:
+                        upload_cache.remove(content_hash)
+            if video_file is None:
+                upload_path = video_path
+                if self.proxy_preset:
+                    self._set_state(video_path, "TRANSCODING")
+                    upload_path = make_proxy(video_path, self.proxy_preset)
+                self._set_state(video_path, "UPLOADING")
+                try:
+                    video_file = upload_video(upload_path, content_hash)
+                finally:
+                    if upload_path != video_path:
+                        os.remove(upload_path)
+                upload_cache.put(content_hash, video_file)
+        except Exception as e:
+            self._set_state(video_path, "FAILED")
+            future.set_exception(e)
+            return
+        self._resolve_or_schedule(video_path, video_file, future, POLL_INITIAL_DELAY)
+
+    def _resolve_or_schedule(self, video_path, video_file, future, delay):
+        state = video_file.state.name
+        self._set_state(video_path, state)
+        if state != "PROCESSING" and video_file.name in self.processing_since:
+            tracer.record(
+                "file_processing",
+                self.processing_since.pop(video_file.name),
+                time.time(),
+                "upload",
+                path=video_path,
+                state=state,
+            )
+        if state == "PROCESSING":
+            self.processing_since.setdefault(video_file.name, time.time())
+            with self.condition:
+                self.pending[video_file.name] = (
+                    video_path,
+                    future,
+                    delay,
+                    time.time() + jittered(delay),
+                )
+                self.condition.notify_all()
+        elif state == "FAILED":
+            future.set_exception(
+                ValueError(f"File processing failed: {video_file.state.name}")
+            )
+        else:
+            print(f"File ready: {video_file.uri}")
+            future.set_result(video_file)
+
+    def _poll_loop(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending and self.closed:
+                    return
+                now = time.time()
+                due = [
+                    (name, entry)
+                    for name, entry in self.pending.items()
+                    if entry[3] <= now
+                ]
+                if not due:
+                    soonest = min(entry[3] for entry in self.pending.values())
+                    self.condition.wait(timeout=soonest - now)
+                    continue
+                for name, _ in due:
+                    del self.pending[name]
+
+            for name, (video_path, future, delay, _) in due:
+                try:
+                    video_file = genai.get_file(name)
+                except Exception as e:
+                    self._set_state(video_path, "FAILED")
+                    future.set_exception(e)
+                    continue
+                self._resolve_or_schedule(
+                    video_path, video_file, future, next_poll_delay(delay)
+                )
+
+            with self.condition:
+                self.condition.notify_all()
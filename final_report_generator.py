@@ -1,30 +1,96 @@
 import os
 import json
-from typing import List, Dict
+from typing import List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from models import (
     get_gemini_flash_model_text,
     get_gemini_flash_model_json,
-    get_final_report_model_text,
+    send_request,
+)
+from model_router import model_router
+from model_statistics import model_stats, record_model_call
+from response_cache import response_cache, sha256_text
+from token_budget import (
+    CONSOLIDATION_TOKEN_BUDGET,
+    split_text_to_budget,
+    split_to_budget,
+)
+from task_graph import TaskGraph
+from artifact_store import ArtifactStore
+from streaming import stream_writer
+from prompt_logic_intertextual import merge_intertextual_references
+from content_generator import ANALYSIS_ERROR_PREFIX
+from structured_elements import (
+    merge_structured_elements,
+    parse_structured_elements,
+    render_structured_elements,
 )
-from model_statistics import record_model_call
 
 BASE_DIR = r"C:\Users\kevin\repos\yt_gemini_video_summary"
 INTERIM_DIR = os.path.join(BASE_DIR, "interim")
 OUTPUT_DIR = os.path.join(BASE_DIR, "output")
 
-
-def load_work_products(interim_dir: str) -> Dict[str, List[str]]:
-    work_products = {
-        "video_analysis": [],
-        "transcript_analysis": [],
-        "intertextual_analysis": [],
-        "summary": [],
-    }
+# Chunks merged per consolidation call. Consolidation reorganises rather than
+# summarises, so output grows with input; a small fan-in keeps each response
+# well under the output limit.
+CONSOLIDATION_FAN_IN = 4
+MAX_CONSOLIDATION_WORKERS = 4
+
+# Intertextual references are merged locally by name. Set this to also have
+# the model group references that name the same idea in different words.
+SEMANTIC_INTERTEXTUAL_MERGE = os.getenv("SEMANTIC_INTERTEXTUAL_MERGE", "") == "1"
+
+
+WORK_PRODUCT_TYPES = [
+    "video_analysis",
+    "transcript_analysis",
+    "intertextual_analysis",
+    "summary",
+]
+
+
+def load_work_products(
+    interim_dir: str,
+    video_title: str = None,
+    video_id: str = None,
+    chunk_plan: List[Tuple[float, float]] = None,
+) -> Dict[str, List[str]]:
+    # Indexed, chronologically ordered reads for runs that wrote to the store.
+    # With a chunk plan only its chunks are read; the store is shared by
+    # every run of the video.
+    if video_id is not None:
+        store = ArtifactStore.for_directory(interim_dir)
+        bounds = None
+        if chunk_plan is not None:
+            bounds = {(start / 60, end / 60) for start, end in chunk_plan}
+        work_products = {
+            wp_type: [
+                content.strip()
+                for chunk_start, chunk_end, content in store.range(video_id, wp_type)
+                if content.strip()
+                and (bounds is None or (chunk_start, chunk_end) in bounds)
+            ]
+            for wp_type in WORK_PRODUCT_TYPES
+        }
+        if any(work_products.values()):
+            for wp_type, chunks in work_products.items():
+                print(f"Debug: Total {wp_type} chunks loaded: {len(chunks)}")
+            return work_products
+
+    # Fall back to scanning interim files written before the store existed
+    work_products = {wp_type: [] for wp_type in WORK_PRODUCT_TYPES}
+
+    # Interim files are no longer wiped between runs, so only pick up the ones
+    # written for this video
+    prefix = ""
+    if video_title:
+        prefix = f"wp_{''.join(e for e in video_title if e.isalnum())[:20]}_"
 
     print(f"Debug: Searching for files in {interim_dir}")
-    for filename in os.listdir(interim_dir):
+    # Sorted so that identical interim files always build identical prompts
+    for filename in sorted(os.listdir(interim_dir)):
         print(f"Debug: Found file: {filename}")
-        if filename.endswith(".txt"):
+        if filename.endswith(".txt") and filename.startswith(prefix):
             file_path = os.path.join(interim_dir, filename)
             try:
                 with open(file_path, "r", encoding="utf-8") as f:
@@ -68,39 +134,35 @@ def load_work_products(interim_dir: str) -> Dict[str, List[str]]:
     return work_products
 
 
-def save_prompt(prompt: str, filename: str):
-    with open(os.path.join(OUTPUT_DIR, filename), "w", encoding="utf-8") as f:
+def save_prompt(prompt: str, filename: str, output_dir: str = OUTPUT_DIR):
+    with open(os.path.join(output_dir, filename), "w", encoding="utf-8") as f:
         f.write(prompt)
     print(f"Debug: Saved prompt to {filename}")
 
 
-def consolidate_chunks(chunks: List[str], work_product_type: str) -> str:
-    print(f"Debug: Consolidating {work_product_type} chunks (total: {len(chunks)})")
+def build_consolidation_prompt(chunks: List[str], work_product_type: str) -> str:
+    joined_chunks = "\n\n".join(chunks)
 
     if work_product_type == "intertextual_analysis":
-        model = get_gemini_flash_model_json()
-    else:
-        model = get_gemini_flash_model_text()
-
-    if work_product_type == "intertextual_analysis":
-        prompt = f"""
+        return f"""
         Consolidate the following {work_product_type} chunks into a single coherent JSON document:
 
-        {'\n\n'.join(chunks)}
+        {joined_chunks}
 
         Instructions:
         1. Combine all references from all chunks into a single JSON array.
         2. Maintain the original structure of each reference object.
         3. Ensure all unique references from each chunk are retained.
-        4. Do not summarize or paraphrase the content; instead, reorganize it.
+        4. Merge references that name the same work, concept or event in different words, combining their occurrences.
+        5. Do not summarize or paraphrase the content; instead, reorganize it.
 
         Format the output as a valid JSON array of reference objects.
         """
-    else:
-        prompt = f"""
+
+    return f"""
         Consolidate the following {work_product_type} chunks into a single coherent document:
 
-        {'\n\n'.join(chunks)}
+        {joined_chunks}
 
         Instructions:
         1. Identify the common headers across all chunks.
@@ -113,17 +175,131 @@ def consolidate_chunks(chunks: List[str], work_product_type: str) -> str:
         Format the output as a well-structured Markdown document.
         """
 
-    save_prompt(prompt, f"prompt_consolidate_{work_product_type}.txt")
+
+def consolidate_batch(
+    chunks: List[str],
+    work_product_type: str,
+    prompt_name: str,
+    output_dir: str = OUTPUT_DIR,
+) -> str:
+    if work_product_type == "intertextual_analysis":
+        model = get_gemini_flash_model_json()
+    else:
+        model = get_gemini_flash_model_text()
+
+    prompt = build_consolidation_prompt(chunks, work_product_type)
+    save_prompt(prompt, f"prompt_consolidate_{prompt_name}.txt", output_dir)
+
+    writer = stream_writer(f"consolidate {prompt_name}")
 
     @record_model_call
     def generate_content(model, prompt):
-        return model.generate_content(prompt)
+        return send_request(
+            model,
+            prompt,
+            max_input_tokens=CONSOLIDATION_TOKEN_BUDGET + 1_000,
+            on_text=writer,
+        )
 
     response = generate_content(model, prompt)
-    consolidated = response.text
+    if writer is not None:
+        writer.finish()
+    return response.text
+
+
+def consolidate_level(
+    chunks: List[str], work_product_type: str, level: int, output_dir: str = OUTPUT_DIR
+) -> List[str]:
+    batches = split_to_budget(
+        chunks, CONSOLIDATION_TOKEN_BUDGET, max_items=CONSOLIDATION_FAN_IN
+    )
+
+    def consolidate(indexed_batch):
+        i, batch = indexed_batch
+        if len(batch) == 1:
+            return batch[0]  # Nothing to merge
+        return consolidate_batch(
+            batch,
+            work_product_type,
+            f"{work_product_type}_l{level}_b{i:02d}",
+            output_dir,
+        )
+
+    print(
+        f"Debug: {work_product_type} level {level}: {len(chunks)} chunks -> {len(batches)} batches"
+    )
+    # map() returns results in batch order, which keeps the text chronological
+    with ThreadPoolExecutor(max_workers=MAX_CONSOLIDATION_WORKERS) as executor:
+        return list(executor.map(consolidate, enumerate(batches)))
+
+
+def consolidate_chunks(
+    chunks: List[str],
+    work_product_type: str,
+    output_dir: str = OUTPUT_DIR,
+    semantic: bool = SEMANTIC_INTERTEXTUAL_MERGE,
+) -> str:
+    print(f"Debug: Consolidating {work_product_type} chunks (total: {len(chunks)})")
+
+    if work_product_type == "intertextual_analysis":
+        # The references are already structured, so dedupe them locally; the
+        # model is only asked to group the merged list when semantic is set
+        merged = merge_intertextual_references(chunks)
+        if semantic:
+            merged = consolidate_batch(
+                [merged], work_product_type, work_product_type, output_dir
+            )
+        return save_consolidated(merged, work_product_type, output_dir)
+
+    if work_product_type == "video_analysis":
+        # Structured analyses are merged locally, which also drops slides
+        # repeated across chunks. Markdown analyses from older runs still go
+        # through the model.
+        try:
+            elements = merge_structured_elements(
+                [
+                    chunk
+                    for chunk in chunks
+                    if not chunk.startswith(ANALYSIS_ERROR_PREFIX)
+                ]
+            )
+        except ValueError as e:
+            print(f"Debug: Consolidating video_analysis with the model: {str(e)}")
+        else:
+            merged = json.dumps({"structured_elements": elements}, indent=2)
+            return save_consolidated(merged, work_product_type, output_dir)
+
+    # A chunk over the budget can't be sent even on its own, so cut it into
+    # pieces small enough that any two adjacent ones fit a batch
+    chunks = [
+        piece
+        for chunk in chunks
+        for piece in split_text_to_budget(chunk, CONSOLIDATION_TOKEN_BUDGET // 2)
+    ]
+
+    # Tree reduction: consolidate adjacent chunks in parallel batches that fit
+    # the token budget, then merge those results the same way until a single
+    # batch is left for the final pass. Depth grows with log(chunks).
+    level = 0
+    while (
+        len(chunks) > 1
+        and len(
+            split_to_budget(chunks, CONSOLIDATION_TOKEN_BUDGET, CONSOLIDATION_FAN_IN)
+        )
+        > 1
+    ):
+        chunks = consolidate_level(chunks, work_product_type, level, output_dir)
+        level += 1
+    consolidated = consolidate_batch(
+        chunks, work_product_type, work_product_type, output_dir
+    )
+    return save_consolidated(consolidated, work_product_type, output_dir)
+
+
+def save_consolidated(consolidated: str, work_product_type: str, output_dir: str):
     print(f"Debug: Consolidated {work_product_type} length: {len(consolidated)}")
 
-    output_file = os.path.join(OUTPUT_DIR, f"consolidated_{work_product_type}.txt")
+    output_file = os.path.join(output_dir, f"consolidated_{work_product_type}.txt")
     with open(output_file, "w", encoding="utf-8") as f:
         f.write(consolidated)
     print(f"Debug: Saved consolidated {work_product_type} to {output_file}")
@@ -131,9 +307,10 @@ def consolidate_chunks(chunks: List[str], work_product_type: str) -> str:
     return consolidated
 
 
-def generate_main_content(consolidated_products: Dict[str, str]) -> str:
+def generate_main_content(
+    consolidated_products: Dict[str, str], output_dir: str = OUTPUT_DIR
+) -> str:
     print("Debug: Generating main content")
-    model = get_final_report_model_text()
     prompt = f"""
     Generate a comprehensive report based on the following consolidated analyses:
 
@@ -158,17 +335,24 @@ def generate_main_content(consolidated_products: Dict[str, str]) -> str:
     Ensure that you incorporate relevant information from all analyses in a cohesive manner.
     """
 
-    save_prompt(prompt, "prompt_main_content.txt")
+    model = model_router.route("generate_main_content", prompt)
+    save_prompt(prompt, "prompt_main_content.txt", output_dir)
+    # When streaming, main_content.txt fills in while the response arrives
+    writer = stream_writer(
+        "main_content", output_file=os.path.join(output_dir, "main_content.txt")
+    )
 
     @record_model_call
     def generate_content(model, prompt):
-        return model.generate_content(prompt)
+        return send_request(model, prompt, on_text=writer)
 
     response = generate_content(model, prompt)
+    if writer is not None:
+        writer.finish()
     main_content = response.text
     print(f"Debug: Generated main content length: {len(main_content)}")
 
-    output_file = os.path.join(OUTPUT_DIR, "main_content.txt")
+    output_file = os.path.join(output_dir, "main_content.txt")
     with open(output_file, "w", encoding="utf-8") as f:
         f.write(main_content)
     print(f"Debug: Saved main content to {output_file}")
@@ -176,9 +360,9 @@ def generate_main_content(consolidated_products: Dict[str, str]) -> str:
     return main_content
 
 
-def generate_structured_elements_appendix(video_analysis: str) -> str:
-    print("Debug: Generating structured elements appendix")
-    model = get_final_report_model_text()
+def extract_structured_elements_appendix(
+    video_analysis: str, output_dir: str = OUTPUT_DIR
+) -> str:
     prompt = f"""
     Extract and format all structured elements (such as slides, charts, or diagrams) mentioned in the following video analysis:
 
@@ -188,17 +372,35 @@ def generate_structured_elements_appendix(video_analysis: str) -> str:
     Use Markdown formatting for better readability.
     """
 
-    save_prompt(prompt, "prompt_structured_elements_appendix.txt")
+    model = model_router.route("extract_structured_elements_appendix", prompt)
+    save_prompt(prompt, "prompt_structured_elements_appendix.txt", output_dir)
+    writer = stream_writer(
+        "structured_elements_appendix",
+        output_file=os.path.join(output_dir, "structured_elements_appendix.txt"),
+    )
 
     @record_model_call
     def generate_content(model, prompt):
-        return model.generate_content(prompt)
+        return send_request(model, prompt, on_text=writer)
 
     response = generate_content(model, prompt)
-    appendix = response.text
+    if writer is not None:
+        writer.finish()
+    return response.text
+
+
+def generate_structured_elements_appendix(
+    video_analysis: str, output_dir: str = OUTPUT_DIR
+) -> str:
+    print("Debug: Generating structured elements appendix")
+    try:
+        appendix = render_structured_elements(parse_structured_elements(video_analysis))
+    except ValueError:
+        # Prose analysis from an older run; have the model extract the elements
+        appendix = extract_structured_elements_appendix(video_analysis, output_dir)
     print(f"Debug: Generated structured elements appendix length: {len(appendix)}")
 
-    output_file = os.path.join(OUTPUT_DIR, "structured_elements_appendix.txt")
+    output_file = os.path.join(output_dir, "structured_elements_appendix.txt")
     with open(output_file, "w", encoding="utf-8") as f:
         f.write(appendix)
     print(f"Debug: Saved structured elements appendix to {output_file}")
@@ -206,9 +408,10 @@ def generate_structured_elements_appendix(video_analysis: str) -> str:
     return appendix
 
 
-def generate_intertextual_analysis_appendix(intertextual_analysis: str) -> str:
+def generate_intertextual_analysis_appendix(
+    intertextual_analysis: str, output_dir: str = OUTPUT_DIR
+) -> str:
     print("Debug: Generating intertextual analysis appendix")
-    model = get_final_report_model_text()
     prompt = f"""
     Organize and present the following intertextual analysis in a clear, structured format suitable for an appendix:
 
@@ -218,17 +421,24 @@ def generate_intertextual_analysis_appendix(intertextual_analysis: str) -> str:
     Use Markdown formatting for better readability.
     """
 
-    save_prompt(prompt, "prompt_intertextual_analysis_appendix.txt")
+    model = model_router.route("generate_intertextual_analysis_appendix", prompt)
+    save_prompt(prompt, "prompt_intertextual_analysis_appendix.txt", output_dir)
+    writer = stream_writer(
+        "intertextual_analysis_appendix",
+        output_file=os.path.join(output_dir, "intertextual_analysis_appendix.txt"),
+    )
 
     @record_model_call
     def generate_content(model, prompt):
-        return model.generate_content(prompt)
+        return send_request(model, prompt, on_text=writer)
 
     response = generate_content(model, prompt)
+    if writer is not None:
+        writer.finish()
     appendix = response.text
     print(f"Debug: Generated intertextual analysis appendix length: {len(appendix)}")
 
-    output_file = os.path.join(OUTPUT_DIR, "intertextual_analysis_appendix.txt")
+    output_file = os.path.join(output_dir, "intertextual_analysis_appendix.txt")
     with open(output_file, "w", encoding="utf-8") as f:
         f.write(appendix)
     print(f"Debug: Saved intertextual analysis appendix to {output_file}")
@@ -236,23 +446,100 @@ def generate_intertextual_analysis_appendix(intertextual_analysis: str) -> str:
     return appendix
 
 
-def generate_final_report(video_title: str):
-    print(f"Debug: Starting final report generation for '{video_title}'")
+def checkpointed(manifest, name: str, output_file: str, func, inputs=None):
+    """Wrap a report node so a restarted run reuses its saved output.
 
-    work_products = load_work_products(INTERIM_DIR)
+    The node is skipped when the manifest shows it completed from the same
+    inputs (its dependencies' results plus `inputs`) and its output file is
+    unchanged.
+    """
 
-    consolidated_products = {}
-    for wp_type, chunks in work_products.items():
-        consolidated_products[wp_type] = consolidate_chunks(chunks, wp_type)
+    def run(*args):
+        input_hash = sha256_text(json.dumps([inputs, args]))
+        if manifest is not None:
+            content = manifest.completed_output(name, input_hash=input_hash)
+            if content is not None:
+                print(f"Resuming: {name} already complete")
+                return content
+        content = func(*args)
+        if manifest is not None:
+            manifest.mark_complete(
+                name, input_hash=input_hash, output_path=output_file, content=content
+            )
+        return content
+
+    return run
+
+
+def generate_final_report(
+    video_title: str,
+    video_id: str = None,
+    manifest=None,
+    interim_dir: str = INTERIM_DIR,
+    output_dir: str = OUTPUT_DIR,
+    chunk_plan: List[Tuple[float, float]] = None,
+):
+    print(f"Debug: Starting final report generation for '{video_title}'")
 
-    main_content = generate_main_content(consolidated_products)
+    work_products = load_work_products(interim_dir, video_title, video_id, chunk_plan)
 
-    structured_elements_appendix = generate_structured_elements_appendix(
-        consolidated_products["video_analysis"]
+    # Each node starts as soon as the products it needs exist, e.g. the
+    # structured elements appendix only waits for the video consolidation
+    graph = TaskGraph()
+    for wp_type, chunks in work_products.items():
+        graph.add(
+            f"consolidate_{wp_type}",
+            checkpointed(
+                manifest,
+                f"report:consolidate_{wp_type}",
+                os.path.join(output_dir, f"consolidated_{wp_type}.txt"),
+                lambda chunks=chunks, wp_type=wp_type: consolidate_chunks(
+                    chunks, wp_type, output_dir
+                ),
+                inputs=[chunks, SEMANTIC_INTERTEXTUAL_MERGE],
+            ),
+        )
+    graph.add(
+        "main_content",
+        checkpointed(
+            manifest,
+            "report:main_content",
+            os.path.join(output_dir, "main_content.txt"),
+            lambda *products: generate_main_content(
+                dict(zip(work_products, products)), output_dir
+            ),
+        ),
+        [f"consolidate_{wp_type}" for wp_type in work_products],
     )
-    intertextual_appendix = generate_intertextual_analysis_appendix(
-        consolidated_products["intertextual_analysis"]
+    graph.add(
+        "structured_elements_appendix",
+        checkpointed(
+            manifest,
+            "report:structured_elements_appendix",
+            os.path.join(output_dir, "structured_elements_appendix.txt"),
+            lambda video_analysis: generate_structured_elements_appendix(
+                video_analysis, output_dir
+            ),
+        ),
+        ["consolidate_video_analysis"],
     )
+    graph.add(
+        "intertextual_analysis_appendix",
+        checkpointed(
+            manifest,
+            "report:intertextual_analysis_appendix",
+            os.path.join(output_dir, "intertextual_analysis_appendix.txt"),
+            lambda intertextual_analysis: generate_intertextual_analysis_appendix(
+                intertextual_analysis, output_dir
+            ),
+        ),
+        ["consolidate_intertextual_analysis"],
+    )
+    results = graph.run()
+
+    main_content = results["main_content"]
+    structured_elements_appendix = results["structured_elements_appendix"]
+    intertextual_appendix = results["intertextual_analysis_appendix"]
 
     final_report = f"""
     # {video_title} - Analysis Report
@@ -269,7 +556,7 @@ def generate_final_report(video_title: str):
     """
 
     output_file = os.path.join(
-        OUTPUT_DIR, f"{video_title.replace(' ', '_')}_final_report.md"
+        output_dir, f"{video_title.replace(' ', '_')}_final_report.md"
     )
     with open(output_file, "w", encoding="utf-8") as f:
         f.write(final_report)
@@ -277,7 +564,21 @@ def generate_final_report(video_title: str):
     print(f"Final report generated: {output_file}")
     print(f"Debug: Final report length: {len(final_report)}")
 
+    return output_file
+
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Bypass the on-disk response cache",
+    )
+    args = parser.parse_args()
+    response_cache.bypass = args.no_cache
+
     video_title = "Forcing Functions - Constraints, Affordances, Bounds, and Systems Behavior  [SYSTEMS THINKING]"
     generate_final_report(video_title)
+    print("\n" + model_stats.generate_report())
@@ -0,0 +1,19 @@
+import os
+
+# GENAI_BACKEND=fake swaps the Gemini SDK for the local stand-in in
+# fake_genai.py, for benchmarks and offline runs that must not spend quota
+GENAI_BACKEND = os.getenv("GENAI_BACKEND", "google")
+
+if GENAI_BACKEND == "fake":
+    import fake_genai as genai
+
+    HarmCategory = genai.types.HarmCategory
+    HarmBlockThreshold = genai.types.HarmBlockThreshold
+else:
+    import google.generativeai as genai
+    from google.generativeai.types import HarmCategory, HarmBlockThreshold
+
+
+def is_rate_limit_error(error):
+    # google.api_core's ResourceExhausted carries the HTTP status in .code
+    return getattr(error, "code", None) == 429
@@ -0,0 +1,145 @@
+import os
+import glob
+import subprocess
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from error_handling import VideoProcessingError
+from structured_elements import format_timestamp
+from tracing import tracer
+from video_downloader import FFMPEG_BINARY
+
+# Seconds between sampled frames. Slides stay up far longer than this.
+KEYFRAME_INTERVAL = float(os.getenv("KEYFRAME_INTERVAL", "2"))
+
+# dHash compares a (HASH_SIZE + 1) x HASH_SIZE greyscale thumbnail, giving a
+# 64-bit hash. Frames within DUPLICATE_THRESHOLD bits of the last kept frame
+# are treated as the same slide (cursor moves, webcam overlay, compression).
+HASH_SIZE = 8
+DUPLICATE_THRESHOLD = int(os.getenv("KEYFRAME_DUPLICATE_THRESHOLD", "6"))
+
+# Upper bound on frames sent per chunk; more are thinned out evenly
+MAX_KEYFRAMES = 100
+KEYFRAME_WIDTH = 1280
+KEYFRAME_WORKERS = os.cpu_count() or 1
+
+Keyframe = namedtuple("Keyframe", ["timestamp", "data"])
+
+
+def dhash(path):
+    try:
+        from PIL import Image
+    except ImportError:
+        raise VideoProcessingError(
+            "Keyframe extraction needs Pillow: pip install Pillow"
+        )
+
+    with Image.open(path) as image:
+        pixels = list(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE)).getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def sample_frames(video_path, output_dir, start, duration, interval):
+    """Write one JPEG every `interval` seconds of [start, start + duration).
+
+    Returns (timestamp, path) pairs, timestamps relative to the video start.
+    """
+    pattern = os.path.join(output_dir, f"frame_{start:08.1f}_%05d.jpg")
+    command = [
+        FFMPEG_BINARY,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-ss",
+        f"{start:.3f}",
+        "-t",
+        f"{duration:.3f}",
+        "-i",
+        video_path,
+        "-vf",
+        f"fps=1/{interval},scale='min({KEYFRAME_WIDTH},iw)':-2",
+        "-q:v",
+        "3",
+        pattern,
+    ]
+    try:
+        subprocess.run(command, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise VideoProcessingError(f"ffmpeg frame extraction failed: {str(e)}")
+
+    frames = sorted(glob.glob(pattern.replace("%05d", "*")))
+    return [(start + n * interval, path) for n, path in enumerate(frames)]
+
+
+@tracer.traced("extract_keyframes")
+def extract_keyframes(
+    video_path,
+    duration,
+    interval=KEYFRAME_INTERVAL,
+    threshold=DUPLICATE_THRESHOLD,
+    max_workers=KEYFRAME_WORKERS,
+):
+    """Sample frames from a video and drop near-duplicates.
+
+    The video is cut into one time slice per worker so ffmpeg decodes them in
+    parallel. Each frame is kept only if its perceptual hash differs from the
+    last kept frame by more than `threshold` bits. Returns Keyframes with
+    timestamps in seconds from the start of the video.
+    """
+    slice_length = max(duration / max_workers, interval)
+    # Slice starts fall on the sampling grid so no timestamp is sampled twice
+    slice_length = -(-slice_length // interval) * interval
+    starts = [n * slice_length for n in range(int(-(-duration // slice_length)))]
+
+    with tempfile.TemporaryDirectory(prefix="keyframes_") as frame_dir:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            slices = executor.map(
+                lambda start: sample_frames(
+                    video_path, frame_dir, start, slice_length, interval
+                ),
+                starts,
+            )
+            frames = [frame for frames in slices for frame in frames]
+            hashes = list(executor.map(dhash, [path for _, path in frames]))
+
+        keyframes = []
+        last_hash = None
+        for (timestamp, path), frame_hash in zip(frames, hashes):
+            if (
+                last_hash is not None
+                and hamming_distance(frame_hash, last_hash) <= threshold
+            ):
+                continue
+            last_hash = frame_hash
+            with open(path, "rb") as f:
+                keyframes.append(Keyframe(timestamp, f.read()))
+
+    print(
+        f"Debug: Kept {len(keyframes)} of {len(frames)} sampled frames from {video_path}"
+    )
+    if len(keyframes) > MAX_KEYFRAMES:
+        step = len(keyframes) / MAX_KEYFRAMES
+        keyframes = [keyframes[int(n * step)] for n in range(MAX_KEYFRAMES)]
+    return keyframes
+
+
+def keyframe_parts(keyframes, offset=0):
+    """Content parts for a request: each frame's timestamp, then the image.
+
+    offset is added to the timestamps, e.g. the chunk's start in seconds.
+    """
+    parts = []
+    for keyframe in keyframes:
+        parts.append(f"Frame at {format_timestamp(offset + keyframe.timestamp)}:")
+        parts.append({"mime_type": "image/jpeg", "data": keyframe.data})
+    return parts
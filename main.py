@@ -2,13 +2,27 @@ import os
 import sys
 import json
 import shutil
+import argparse
 from dotenv import load_dotenv
-from video_downloader import get_video_info, download_youtube_video
-from video_processor import process_video
+from video_downloader import get_video_info, iter_youtube_video_chunks
+from video_processor import process_video, MAX_CONCURRENT_CHUNKS
+from chunk_planner import plan_chunks
+from proxy_transcode import PROXY_PRESET, PROXY_PRESETS
+from tracing import TRACE_FILE, tracer
 from final_report_generator import generate_final_report
 from utils import setup_directories
 from error_handling import VideoProcessingError
 from model_statistics import model_stats
+from models import warm_up_models
+from model_router import model_router
+from run_manifest import RunManifest
+from run_forecast import (
+    forecast_run,
+    forecast_video,
+    format_comparison,
+    format_forecast,
+)
+from utils import get_timed_transcript
 
 # Add the project root directory to Python path
 project_root = os.path.dirname(os.path.abspath(__file__))
@@ -38,42 +52,150 @@ def clear_directory(directory):
     print(f"{directory} directory cleared.")
 
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Analyse a YouTube video with Gemini and write a report."
+    )
+    parser.add_argument(
+        "--fresh",
+        action="store_true",
+        help="Clear the interim, input and output directories instead of resuming",
+    )
+    parser.add_argument(
+        "--chunk-minutes",
+        type=float,
+        help="Use fixed-length chunks instead of planning them from the video length",
+    )
+    parser.add_argument(
+        "--proxy-preset",
+        choices=sorted(PROXY_PRESETS),
+        default=PROXY_PRESET or None,
+        help="Upload a small, silent proxy of each chunk instead of the original",
+    )
+    parser.add_argument(
+        "--trace",
+        default=TRACE_FILE or None,
+        help="Write a Chrome trace of the run to this file",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Print the forecast calls, tokens and minimum time, then exit",
+    )
+    return parser.parse_args(argv)
+
+
+@tracer.traced()
+def run_video(
+    video_id,
+    input_dir,
+    interim_dir,
+    output_dir,
+    confirm_long=True,
+    chunk_minutes=None,
+    proxy_preset=PROXY_PRESET,
+    forecasts=None,
+):
+    """Download, analyse and report on one video.
+
+    Returns the final report path, or None if the user cancelled. With
+    confirm_long=False videos longer than an hour are processed without
+    asking, for unattended runs. chunk_minutes overrides the planned chunk
+    length, and proxy_preset picks a PROXY_PRESETS entry for uploads.
+
+    The run's forecast is compared with model_stats once the report is
+    written. Runs that share model_stats with other videos pass a forecasts
+    list instead; the forecast is appended to it and compared by the caller.
+    """
+    setup_directories([input_dir, output_dir, interim_dir])
+    # Completed stages recorded here are skipped when a run is restarted
+    manifest = RunManifest.for_video(interim_dir, video_id)
+    video_title, duration = get_video_info(video_id)
+
+    if not video_title or not duration:
+        raise VideoProcessingError("Failed to retrieve video information.")
+
+    duration_minutes = duration / 60
+    print(f"Video duration: {duration_minutes:.2f} minutes")
+
+    if duration_minutes > 60 and confirm_long:
+        proceed = input(
+            f"The video '{video_title}' is longer than an hour. Do you want to continue? (y/n): "
+        )
+        if proceed.lower() != "y":
+            print("Operation cancelled.")
+            return None
+
+    print(f"Processing video: {video_title}")
+    chunk_plan = plan_chunks(
+        duration,
+        chunk_minutes * 60 if chunk_minutes else None,
+        parallelism=MAX_CONCURRENT_CHUNKS,
+    )
+    print(f"Planned {len(chunk_plan)} chunks of {chunk_plan[0][1] / 60:.1f} minutes")
+    # Fetched once for both the forecast and the analysis
+    transcript = get_timed_transcript(video_id)
+    forecast = forecast_run(duration, transcript.char_count, chunk_plan)
+    print("\n" + format_forecast(forecast))
+    if forecasts is not None:
+        forecasts.append(forecast)
+    # Chunks are uploaded as the segmenter produces them
+    video_chunks = iter_youtube_video_chunks(
+        video_id, input_dir, chunk_plan, manifest=manifest
+    )
+
+    summary_chunks, intertextual_chunks, video_analyses = process_video(
+        video_chunks,
+        video_id,
+        video_title,
+        chunk_plan,
+        manifest=manifest,
+        interim_dir=interim_dir,
+        transcript=transcript,
+        proxy_preset=proxy_preset,
+    )
+
+    # Generate the final report
+    report_file = generate_final_report(
+        video_title,
+        video_id,
+        manifest=manifest,
+        interim_dir=interim_dir,
+        output_dir=output_dir,
+        chunk_plan=chunk_plan,
+    )
+    if forecasts is None:
+        print("\n" + format_comparison(forecast, model_stats.stage_totals()))
+    return report_file
+
+
+def main(argv=None):
+    args = parse_args(argv)
     try:
         setup_directories([INPUT_DIR, OUTPUT_DIR, INTERIM_DIR])
-        clear_directory(INTERIM_DIR)  # Clear interim directory at the start
-        clear_directory(INPUT_DIR)  # Clear input directory at the start
-        clear_directory(OUTPUT_DIR)  # Clear output directory at the start
+        if args.plan:
+            # Nothing is cleared, downloaded or sent to a model
+            video_id = input("Enter the YouTube video ID: ")
+            print(format_forecast(forecast_video(video_id, args.chunk_minutes)))
+            return
+
+        if args.fresh:
+            clear_directory(INTERIM_DIR)
+            clear_directory(INPUT_DIR)
+            clear_directory(OUTPUT_DIR)
+        warm_up_models()
 
         video_id = input("Enter the YouTube video ID: ")
-        video_title, duration = get_video_info(video_id)
-
-        if not video_title or not duration:
-            raise VideoProcessingError("Failed to retrieve video information.")
-
-        duration_minutes = duration / 60
-        print(f"Video duration: {duration_minutes:.2f} minutes")
-
-        if duration_minutes > 60:
-            proceed = input(
-                f"The video '{video_title}' is longer than an hour. Do you want to continue? (y/n): "
-            )
-            if proceed.lower() != "y":
-                print("Operation cancelled.")
-                return
-
-        print(f"Processing video: {video_title}")
-        chunk_duration = 10 * 60  # 10 minutes in seconds
-        video_chunks = download_youtube_video(video_id, INPUT_DIR, chunk_duration)
-        if not video_chunks:
-            raise VideoProcessingError("Failed to download video.")
-
-        summary_chunks, intertextual_chunks, video_analyses = process_video(
-            video_chunks, video_id, video_title, duration_minutes
+        report_file = run_video(
+            video_id,
+            INPUT_DIR,
+            INTERIM_DIR,
+            OUTPUT_DIR,
+            chunk_minutes=args.chunk_minutes,
+            proxy_preset=args.proxy_preset or "",
         )
-
-        # Generate the final report
-        generate_final_report(video_title)
+        if report_file is None:
+            return
 
         print("Video processing and final report generation completed successfully.")
 
@@ -92,6 +214,11 @@ def main():
 
     # Print model statistics report
     print("\n" + model_stats.generate_report())
+    if model_router.decisions:
+        print("\n" + model_router.format_report())
+    print("\n" + tracer.format_summary())
+    if args.trace:
+        tracer.export_chrome_trace(args.trace)
 
     sys.exit(1)
 
@@ -0,0 +1,118 @@
+import os
+import json
+import threading
+import time
+from typing import Dict
+from models import (
+    GEMINI_FLASH_LIMITER,
+    GEMINI_PRO_LIMITER,
+    get_final_report_model_text,
+    get_gemini_flash_model_text,
+)
+from model_statistics import model_stats
+from token_budget import estimate_tokens
+from tracing import tracer
+
+# How each final report task picks its model:
+#   "pro"      always Pro, however long the queue
+#   "fallback" Pro, unless its queue wait exceeds PRO_FALLBACK_WAIT
+#   "flash"    always Flash
+# Appendices only reformat material that is already merged, so they don't
+# need Pro. Override per task with e.g.
+# MODEL_TIER_POLICIES='{"generate_main_content": "pro"}'.
+TIER_POLICIES = {
+    "generate_main_content": "fallback",
+    "generate_intertextual_analysis_appendix": "flash",
+    "extract_structured_elements_appendix": "flash",
+}
+TIER_POLICIES.update(json.loads(os.getenv("MODEL_TIER_POLICIES", "{}")))
+
+# Seconds of Pro queue a "fallback" task accepts before switching to Flash
+PRO_FALLBACK_WAIT = float(os.getenv("PRO_FALLBACK_WAIT", "20"))
+
+
+class ModelRouter:
+    """Picks Pro or Flash per task from TIER_POLICIES and the limiter queues.
+
+    Each decision is kept with the queue waits estimated at the time, so the
+    report can set them against how long the task actually took.
+    """
+
+    def __init__(self, policies=TIER_POLICIES, fallback_wait=PRO_FALLBACK_WAIT):
+        self.policies = policies
+        self.fallback_wait = fallback_wait
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.decisions = []
+
+    def policy_for(self, task):
+        policy = self.policies.get(task, "pro")
+        if policy not in ("pro", "fallback", "flash"):
+            raise ValueError(f"Unknown model tier policy '{policy}' for {task}")
+        return policy
+
+    def planned_limiter(self, task):
+        """The limiter a task uses when the Pro queue is short."""
+        if self.policy_for(task) == "flash":
+            return GEMINI_FLASH_LIMITER
+        return GEMINI_PRO_LIMITER
+
+    def route(self, task, prompt):
+        """Return the model to send `prompt` to for `task`."""
+        policy = self.policy_for(task)
+        tokens = estimate_tokens(prompt)
+        pro_wait = GEMINI_PRO_LIMITER.estimated_wait(tokens)
+        flash_wait = GEMINI_FLASH_LIMITER.estimated_wait(tokens)
+
+        tier = "flash" if policy == "flash" else "pro"
+        if policy == "fallback" and pro_wait > self.fallback_wait:
+            tier = "flash"
+            print(f"Debug: {task}: Pro queue ~{pro_wait:.1f}s, falling back to Flash")
+        with self.lock:
+            self.decisions.append(
+                {
+                    "task": task,
+                    "policy": policy,
+                    "tier": tier,
+                    "pro_wait": pro_wait,
+                    "flash_wait": flash_wait,
+                }
+            )
+        now = time.time()
+        tracer.record(
+            "model_route",
+            now,
+            now,
+            "model",
+            task=task,
+            policy=policy,
+            tier=tier,
+            pro_wait=pro_wait,
+            flash_wait=flash_wait,
+        )
+        if tier == "flash":
+            return get_gemini_flash_model_text()
+        return get_final_report_model_text()
+
+    def format_report(self) -> str:
+        # Stage durations include limiter waits, so they are the latency the
+        # report actually saw for each task
+        durations: Dict[str, float] = {
+            stage: totals["duration"]
+            for stage, totals in model_stats.stage_totals().items()
+        }
+        report = "Model Tier Routing:\n\n"
+        report += f"{'Task':<42} {'Policy':<9} {'Tier':<6} {'Pro wait (s)':<13} {'Flash wait (s)':<15} {'Saved (s)':<10} {'Latency (s)':<11}\n"
+        report += "-" * 110 + "\n"
+        for decision in self.decisions:
+            chosen = decision[f"{decision['tier']}_wait"]
+            saved = decision["pro_wait"] - chosen
+            latency = durations.get(decision["task"], 0.0)
+            report += f"{decision['task']:<42} {decision['policy']:<9} {decision['tier']:<6} {decision['pro_wait']:<13.1f} {decision['flash_wait']:<15.1f} {saved:<10.1f} {latency:<11.2f}\n"
+        return report
+
+
+model_router = ModelRouter()
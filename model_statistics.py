@@ -1,11 +1,47 @@
 import time
+import threading
+import functools
 from typing import List, Dict
-import json
+from token_budget import estimate_tokens
 
 
 class ModelStatistics:
     def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
         self.calls: List[Dict] = []
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.rate_limit_retries = 0
+        self.limiter_waits: Dict[str, Dict] = {}
+        self.tasks: List[Dict] = []
+
+    def record_task(self, name: str, start_time: float, end_time: float):
+        with self.lock:
+            self.tasks.append(
+                {"name": name, "start_time": start_time, "end_time": end_time}
+            )
+
+    def record_limiter_wait(self, limiter: str, seconds: float):
+        with self.lock:
+            waits = self.limiter_waits.setdefault(
+                limiter, {"acquisitions": 0, "total_wait": 0.0}
+            )
+            waits["acquisitions"] += 1
+            waits["total_wait"] += seconds
+
+    def record_rate_limit_retry(self):
+        with self.lock:
+            self.rate_limit_retries += 1
+
+    def record_cache_lookup(self, hit: bool):
+        with self.lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
 
     def record_call(
         self,
@@ -16,18 +52,42 @@ class ModelStatistics:
         end_time: float,
         input_tokens: int,
         output_tokens: int,
+        stage: str = None,
+        estimated: bool = False,
     ):
         self.calls.append(
             {
                 "module": module,
                 "function": function,
+                "stage": stage or function,
                 "model": model,
                 "duration": end_time - start_time,
                 "input_tokens": input_tokens,
                 "output_tokens": output_tokens,
+                "estimated": estimated,
             }
         )
 
+    def stage_totals(self) -> Dict[str, Dict]:
+        totals: Dict[str, Dict] = {}
+        for call in self.calls:
+            stage = totals.setdefault(
+                call["stage"],
+                {
+                    "calls": 0,
+                    "duration": 0.0,
+                    "input_tokens": 0,
+                    "output_tokens": 0,
+                    "estimated": False,
+                },
+            )
+            stage["calls"] += 1
+            stage["duration"] += call["duration"]
+            stage["input_tokens"] += call["input_tokens"]
+            stage["output_tokens"] += call["output_tokens"]
+            stage["estimated"] = stage["estimated"] or call["estimated"]
+        return totals
+
     def generate_report(self) -> str:
         report = "Model Call Statistics:\n\n"
         report += f"{'Module':<20} {'Function':<25} {'Model':<20} {'Duration (s)':<15} {'Input Tokens':<15} {'Output Tokens':<15}\n"
@@ -36,33 +96,91 @@ class ModelStatistics:
         for call in self.calls:
             report += f"{call['module']:<20} {call['function']:<25} {call['model']:<20} {call['duration']:<15.2f} {call['input_tokens']:<15} {call['output_tokens']:<15}\n"
 
+        report += "\nTokens by Stage (* = includes estimates):\n\n"
+        report += f"{'Stage':<35} {'Calls':<8} {'Duration (s)':<15} {'Input Tokens':<15} {'Output Tokens':<15}\n"
+        report += "-" * 90 + "\n"
+        for stage, totals in self.stage_totals().items():
+            marker = "*" if totals["estimated"] else ""
+            report += f"{stage + marker:<35} {totals['calls']:<8} {totals['duration']:<15.2f} {totals['input_tokens']:<15} {totals['output_tokens']:<15}\n"
+
+        if self.tasks:
+            origin = min(task["start_time"] for task in self.tasks)
+            report += "\nTask Timings:\n\n"
+            report += (
+                f"{'Task':<35} {'Start (s)':<12} {'End (s)':<12} {'Duration (s)':<15}\n"
+            )
+            report += "-" * 75 + "\n"
+            for task in sorted(self.tasks, key=lambda t: t["start_time"]):
+                report += f"{task['name']:<35} {task['start_time'] - origin:<12.2f} {task['end_time'] - origin:<12.2f} {task['end_time'] - task['start_time']:<15.2f}\n"
+
+        lookups = self.cache_hits + self.cache_misses
+        if lookups:
+            report += f"\nResponse cache: {self.cache_hits} hits, {self.cache_misses} misses ({self.cache_hits / lookups:.0%} hit rate)\n"
+
+        for limiter, waits in self.limiter_waits.items():
+            report += f"Rate limiter {limiter}: {waits['acquisitions']} acquisitions, {waits['total_wait']:.2f}s waiting\n"
+        if self.rate_limit_retries:
+            report += f"Retries after 429 responses: {self.rate_limit_retries}\n"
+
         return report
 
 
 model_stats = ModelStatistics()
 
 
-def record_model_call(func):
+def record_model_call(func=None, *, stage=None):
+    """Record timing and token usage of a model call.
+
+    The wrapped function takes the model as its first argument and the
+    request contents as its second, and returns the response. Usage is read
+    from the response's usage_metadata when present. The stage defaults to
+    the function the call is defined in, e.g. "consolidate_chunks".
+    """
+    if func is None:
+        return functools.partial(record_model_call, stage=stage)
+
+    call_stage = stage or func.__qualname__.split(".<locals>")[0]
+
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
         module = func.__module__
         function = func.__name__
-        model = args[0].__class__.__name__  # Assuming the model is the first argument
+        model = getattr(args[0], "model_name", args[0].__class__.__name__)
+        model = model.removeprefix("models/")
 
         start_time = time.time()
         result = func(*args, **kwargs)
         end_time = time.time()
 
-        # Estimate token counts (you may need to adjust this based on your tokenizer)
-        input_tokens = len(json.dumps(args[1])) // 4  # Rough estimate
-        output_tokens = len(result.text) // 4  # Rough estimate
+        # Cache hits never reached the model
+        if getattr(result, "from_cache", False):
+            return result
+
+        usage = getattr(result, "usage_metadata", None)
+        if usage is not None:
+            input_tokens = usage.prompt_token_count
+            output_tokens = usage.candidates_token_count
+            estimated = False
+        else:
+            input_tokens = estimate_tokens(args[1])
+            try:
+                output_tokens = estimate_tokens(result.text)
+            except ValueError:
+                output_tokens = 0
+            estimated = True
 
         model_stats.record_call(
-            module, function, model, start_time, end_time, input_tokens, output_tokens
+            module,
+            function,
+            model,
+            start_time,
+            end_time,
+            input_tokens,
+            output_tokens,
+            stage=call_stage,
+            estimated=estimated,
         )
 
         return result
 
     return wrapper
-
-
-# Apply this decorator to all model.generate_content calls in your project
@@ -1,8 +1,16 @@
-import google.generativeai as genai
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
+from gemini_client import genai, HarmCategory, HarmBlockThreshold, is_rate_limit_error
 import os
+import json
+import random
+import threading
 import time
 from dotenv import load_dotenv
+from rate_limiter import RateLimiter
+from response_cache import response_cache
+from model_statistics import model_stats
+from token_budget import count_tokens
+from error_handling import TokenBudgetError
+from tracing import tracer
 
 # Load environment variables
 load_dotenv()
@@ -10,25 +18,27 @@ load_dotenv()
 # Configure Gemini API
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
+GEMINI_FLASH_MODEL = "gemini-1.5-flash"
+GEMINI_PRO_MODEL = "gemini-1.5-pro-exp-0801"
 
-class RateLimiter:
-    def __init__(self, max_calls, period):
-        self.max_calls = max_calls
-        self.period = period
-        self.calls = []
+GEMINI_FLASH_LIMITER = RateLimiter(
+    "gemini-flash", requests_per_minute=60, tokens_per_minute=1_000_000
+)
+GEMINI_PRO_LIMITER = RateLimiter(
+    "gemini-pro", requests_per_minute=2, tokens_per_minute=32_000
+)
 
-    def wait(self):
-        now = time.time()
-        self.calls = [call for call in self.calls if now - call < self.period]
-        if len(self.calls) >= self.max_calls:
-            sleep_time = self.calls[0] + self.period - now
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-        self.calls.append(time.time())
+MODEL_LIMITERS = {
+    GEMINI_FLASH_MODEL: GEMINI_FLASH_LIMITER,
+    GEMINI_PRO_MODEL: GEMINI_PRO_LIMITER,
+}
 
+RATE_LIMIT_RETRIES = 3
 
-GEMINI_FLASH_LIMITER = RateLimiter(max_calls=60, period=60)
-GEMINI_PRO_LIMITER = RateLimiter(max_calls=2, period=60)
+MODEL_INPUT_TOKEN_LIMITS = {
+    GEMINI_FLASH_MODEL: 1_000_000,
+    GEMINI_PRO_MODEL: 2_000_000,
+}
 
 # Safety settings to allow all content
 SAFETY_SETTINGS = {
@@ -39,41 +49,184 @@ SAFETY_SETTINGS = {
 }
 
 
-def get_gemini_flash_model_json():
-    GEMINI_FLASH_LIMITER.wait()
-    return genai.GenerativeModel(
-        "gemini-1.5-flash",
-        generation_config={
-            "response_mime_type": "application/json",
-            "temperature": 0.5,
-            "top_p": 0.9,
-            "top_k": 40,
-        },
-        safety_settings=SAFETY_SETTINGS,
+FLASH_JSON_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "temperature": 0.5,
+    "top_p": 0.9,
+    "top_k": 40,
+}
+
+TEXT_GENERATION_CONFIG = {
+    "temperature": 0.5,
+    "top_p": 0.9,
+    "top_k": 40,
+}
+
+
+class ModelRegistry:
+    """Shares one GenerativeModel per (model name, generation config) pair.
+
+    GenerativeModel holds no per-request state, so instances are reused by
+    every thread instead of being rebuilt for each call.
+    """
+
+    def __init__(self):
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def get(self, model_name, generation_config):
+        key = (model_name, json.dumps(generation_config, sort_keys=True))
+        with self.lock:
+            model = self.models.get(key)
+            if model is None:
+                model = genai.GenerativeModel(
+                    model_name,
+                    generation_config=dict(generation_config),
+                    safety_settings=SAFETY_SETTINGS,
+                )
+                self.models[key] = model
+        return model
+
+    def warm_up(self, specs):
+        for model_name, generation_config in specs:
+            self.get(model_name, generation_config)
+        # A cheap metadata call opens the client connection before the first
+        # real request needs it
+        for model_name in {model_name for model_name, _ in specs}:
+            try:
+                genai.get_model(f"models/{model_name}")
+            except Exception as e:
+                print(f"Warning: could not warm up {model_name}: {str(e)}")
+
+
+model_registry = ModelRegistry()
+
+DEFAULT_MODEL_SPECS = [
+    (GEMINI_FLASH_MODEL, FLASH_JSON_GENERATION_CONFIG),
+    (GEMINI_FLASH_MODEL, TEXT_GENERATION_CONFIG),
+    (GEMINI_PRO_MODEL, TEXT_GENERATION_CONFIG),
+]
+
+
+def warm_up_models():
+    model_registry.warm_up(DEFAULT_MODEL_SPECS)
+
+
+def get_gemini_flash_model_json(response_schema=None):
+    if response_schema is None:
+        return model_registry.get(GEMINI_FLASH_MODEL, FLASH_JSON_GENERATION_CONFIG)
+    return model_registry.get(
+        GEMINI_FLASH_MODEL,
+        {**FLASH_JSON_GENERATION_CONFIG, "response_schema": response_schema},
     )
 
 
 def get_gemini_flash_model_text():
-    GEMINI_FLASH_LIMITER.wait()
-    return genai.GenerativeModel(
-        "gemini-1.5-flash",
-        generation_config={
-            "temperature": 0.5,
-            "top_p": 0.9,
-            "top_k": 40,
-        },
-        safety_settings=SAFETY_SETTINGS,
-    )
+    return model_registry.get(GEMINI_FLASH_MODEL, TEXT_GENERATION_CONFIG)
 
 
 def get_final_report_model_text():
-    GEMINI_PRO_LIMITER.wait()
-    return genai.GenerativeModel(
-        "gemini-1.5-pro-exp-0801",
-        generation_config={
-            "temperature": 0.5,
-            "top_p": 0.9,
-            "top_k": 40,
-        },
-        safety_settings=SAFETY_SETTINGS,
-    )
+    return model_registry.get(GEMINI_PRO_MODEL, TEXT_GENERATION_CONFIG)
+
+
+def base_model_name(model):
+    return model.model_name.removeprefix("models/")
+
+
+def get_limiter(model):
+    return MODEL_LIMITERS[base_model_name(model)]
+
+
+def send_request(
+    model,
+    contents,
+    refresh=False,
+    max_input_tokens=None,
+    on_text=None,
+    file_seconds=None,
+):
+    """Call model.generate_content, serving repeated requests from the cache.
+
+    refresh=True skips the lookup but still stores the new response; retries
+    use it so a bad cached answer is not returned again. Requests larger than
+    max_input_tokens (default: the model's context limit) raise
+    TokenBudgetError before anything is sent. With on_text the response is
+    streamed and on_text is called with each piece of text as it arrives;
+    its reset(), if it has one, is called before every attempt. file_seconds
+    is the length of an uploaded video in contents, for the token estimate.
+    """
+    reset_text = getattr(on_text, "reset", None)
+    key = response_cache.make_key(model, contents)
+    if not refresh:
+        cached = response_cache.get(key)
+        model_stats.record_cache_lookup(hit=cached is not None)
+        if cached is not None:
+            if on_text is not None:
+                if reset_text is not None:
+                    reset_text()
+                on_text(cached.text)
+            return cached
+
+    input_tokens = count_tokens(model, contents, file_seconds)
+    budget = max_input_tokens or MODEL_INPUT_TOKEN_LIMITS[base_model_name(model)]
+    if input_tokens > budget:
+        raise TokenBudgetError(
+            f"Request needs ~{input_tokens} input tokens, budget is {budget}"
+        )
+
+    # The rate limit slot is taken here, at send time, so cache hits are free
+    # and every retry pays for its own request
+    limiter = get_limiter(model)
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        limiter.acquire(input_tokens)
+        if reset_text is not None:
+            reset_text()
+        try:
+            with tracer.span(
+                "model_call",
+                "model",
+                model=base_model_name(model),
+                attempt=attempt,
+                input_tokens=input_tokens,
+                stream=on_text is not None,
+            ) as span:
+                if on_text is None:
+                    response = model.generate_content(contents)
+                else:
+                    response = model.generate_content(contents, stream=True)
+                    for piece in response:
+                        try:
+                            text = piece.text
+                        except ValueError:
+                            continue  # e.g. a trailing piece with only metadata
+                        on_text(text)
+                usage = getattr(response, "usage_metadata", None)
+                if usage is not None:
+                    span.set(
+                        input_tokens=usage.prompt_token_count,
+                        output_tokens=usage.candidates_token_count,
+                    )
+            break
+        except Exception as e:
+            # A 429 means the server-side quota disagrees with our limiter;
+            # back off and take a fresh slot
+            if not is_rate_limit_error(e) or attempt == RATE_LIMIT_RETRIES:
+                raise
+            delay = 2**attempt * random.uniform(1, 2)
+            print(f"Rate limited by the API, retrying in {delay:.1f}s")
+            model_stats.record_rate_limit_retry()
+            with tracer.span("rate_limit_backoff", "model", attempt=attempt):
+                time.sleep(delay)
+
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        limiter.adjust(usage.prompt_token_count - input_tokens)
+
+    try:
+        text = response.text
+    except ValueError:
+        # Blocked responses have no text; never cache them
+        return response
+    if text:
+        response_cache.put(key, text)
+    return response
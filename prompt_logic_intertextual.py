@@ -1,10 +1,30 @@
+import re
 import json
-from models import get_gemini_flash_model_json
+from models import get_gemini_flash_model_json, send_request
+from model_statistics import record_model_call
 import time
 
+# One entry of the "references" array, for schema-constrained requests
+REFERENCE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "type": {"type": "string"},
+        "reference": {"type": "string"},
+        "context": {"type": "string"},
+        "explanation": {"type": "string"},
+        "significance": {"type": "string"},
+    },
+    "required": ["type", "reference", "context"],
+}
+
+
+@record_model_call(stage="intertextual_analysis")
+def call_model(model, prompt, refresh, on_text=None):
+    return send_request(model, prompt, refresh=refresh, on_text=on_text)
+
 
 def analyze_intertextual_references(
-    video_analysis, transcript_analysis, chunk_start, chunk_end
+    video_analysis, transcript_analysis, chunk_start, chunk_end, on_text=None
 ):
     max_retries = 3
     retry_delay = 1  # Start with 1 second delay
@@ -37,7 +57,8 @@ def analyze_intertextual_references(
             """
 
             model = get_gemini_flash_model_json()
-            response = model.generate_content(prompt)
+            # A cached response that failed to parse must not be reused
+            response = call_model(model, prompt, attempt > 0, on_text)
             intertextual_analysis = response.text
 
             print(
@@ -66,4 +87,52 @@ def analyze_intertextual_references(
                 return json.dumps({"references": []}, indent=2)
 
 
+def normalize_reference(reference):
+    """Key under which two mentions count as the same reference."""
+    words = re.sub(r"[^\w\s]", " ", str(reference).lower()).split()
+    if words and words[0] in ("the", "a", "an"):
+        words = words[1:]
+    return " ".join(words)
+
+
+def parse_references(chunk):
+    # Chunks are {"references": [...]}; older runs saved a bare array
+    try:
+        parsed = json.loads(chunk)
+    except json.JSONDecodeError as e:
+        print(f"Debug: Skipping unparseable intertextual chunk: {str(e)}")
+        return []
+    if isinstance(parsed, dict):
+        parsed = parsed.get("references", [])
+    if not isinstance(parsed, list):
+        return []
+    return [ref for ref in parsed if isinstance(ref, dict) and ref.get("reference")]
+
+
+def merge_intertextual_references(chunks):
+    """Merge per-chunk intertextual JSON without a model call.
+
+    References with the same normalized name are combined into one entry in
+    order of first appearance. Each keeps the fields of its first mention and
+    lists every chunk (1-based) and context it appeared in.
+    """
+    merged = {}
+    for chunk_number, chunk in enumerate(chunks, start=1):
+        for ref in parse_references(chunk):
+            key = normalize_reference(ref["reference"])
+            if key not in merged:
+                merged[key] = {
+                    field: value for field, value in ref.items() if field != "context"
+                }
+                merged[key]["occurrences"] = []
+            merged[key]["occurrences"].append(
+                {"chunk": chunk_number, "context": ref.get("context", "")}
+            )
+
+    print(
+        f"Debug: Merged intertextual references from {len(chunks)} chunks into {len(merged)} unique references"
+    )
+    return json.dumps({"references": list(merged.values())}, indent=2)
+
+
 # ... (rest of the file remains unchanged)
@@ -0,0 +1,65 @@
+import os
+import subprocess
+from error_handling import VideoProcessingError
+from tracing import tracer
+from video_downloader import FFMPEG_BINARY
+
+# The model samples uploaded video at about one frame per second and the
+# transcript is fetched separately, so a proxy can drop audio, frames and
+# resolution. "slides" keeps 720p so small text stays legible.
+PROXY_PRESETS = {
+    "low": {"fps": 1, "height": 360, "crf": 32},
+    "medium": {"fps": 2, "height": 480, "crf": 28},
+    "slides": {"fps": 1, "height": 720, "crf": 30},
+}
+
+# Preset used when none is given; empty uploads the original chunks
+PROXY_PRESET = os.getenv("PROXY_PRESET", "")
+
+
+def proxy_path_for(video_path, preset):
+    base, ext = os.path.splitext(video_path)
+    return f"{base}_proxy_{preset}{ext}"
+
+
+@tracer.traced("proxy_transcode", "upload")
+def make_proxy(video_path, preset):
+    """Transcode video_path to a small, silent proxy and return its path."""
+    if preset not in PROXY_PRESETS:
+        raise VideoProcessingError(
+            f"Unknown proxy preset '{preset}', expected one of {sorted(PROXY_PRESETS)}"
+        )
+    settings = PROXY_PRESETS[preset]
+    proxy_path = proxy_path_for(video_path, preset)
+    command = [
+        FFMPEG_BINARY,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        video_path,
+        "-an",
+        "-vf",
+        f"fps={settings['fps']},scale=-2:'min({settings['height']},ih)'",
+        "-c:v",
+        "libx264",
+        "-preset",
+        "veryfast",
+        "-crf",
+        str(settings["crf"]),
+        "-movflags",
+        "+faststart",
+        proxy_path,
+    ]
+    try:
+        subprocess.run(command, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise VideoProcessingError(f"ffmpeg proxy transcode failed: {str(e)}")
+
+    original_mb = os.path.getsize(video_path) / (1024 * 1024)
+    proxy_mb = os.path.getsize(proxy_path) / (1024 * 1024)
+    print(
+        f"Debug: Proxy ({preset}) for {video_path}: {original_mb:.1f} MB -> {proxy_mb:.1f} MB"
+    )
+    return proxy_path
@@ -0,0 +1,163 @@
+import os
+import sqlite3
+import threading
+import time
+from model_statistics import model_stats
+from tracing import tracer
+
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "./cache/rate_limits.sqlite3")
+
+
+class RateLimiter:
+    """Token-bucket limiter with requests- and tokens-per-minute budgets.
+
+    Bucket levels are kept in a SQLite database, so every thread and every
+    worker process on the host that uses the same name draws from one budget.
+    """
+
+    def __init__(
+        self, name, requests_per_minute, tokens_per_minute, db_path=RATE_LIMIT_DB
+    ):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.db_path = db_path
+        # Serialises this process's threads so they are served in turn
+        self.lock = threading.Lock()
+        # Threads of this process inside acquire(), served before a new caller
+        self.queued = 0
+        self.queue_lock = threading.Lock()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets "
+            "(name TEXT PRIMARY KEY, requests REAL, tokens REAL, updated REAL)"
+        )
+        return conn
+
+    def _refill(self, row, now):
+        if row is None:
+            return self.requests_per_minute, self.tokens_per_minute
+        requests, tokens, updated = row
+        elapsed = max(now - updated, 0.0)
+        requests = min(
+            self.requests_per_minute,
+            requests + elapsed * self.requests_per_minute / 60,
+        )
+        tokens = min(
+            self.tokens_per_minute, tokens + elapsed * self.tokens_per_minute / 60
+        )
+        return requests, tokens
+
+    def _update(self, conn, request_cost, token_cost, force=False):
+        # BEGIN IMMEDIATE takes the database write lock, which makes the
+        # read-refill-write cycle atomic across processes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT requests, tokens, updated FROM buckets WHERE name = ?",
+                (self.name,),
+            ).fetchone()
+            now = time.time()
+            requests, tokens = self._refill(row, now)
+
+            wait = max(
+                (request_cost - requests) * 60 / self.requests_per_minute,
+                (token_cost - tokens) * 60 / self.tokens_per_minute,
+                0.0,
+            )
+            if force:
+                wait = 0.0
+            if wait == 0.0:
+                requests -= request_cost
+                tokens -= token_cost
+
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, requests, tokens, updated) "
+                "VALUES (?, ?, ?, ?)",
+                (self.name, requests, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def acquire(self, tokens=0):
+        """Block until one request and `tokens` tokens are available.
+
+        Returns the number of seconds spent waiting.
+        """
+        tokens = min(tokens, self.tokens_per_minute)
+        waited = 0.0
+        start_time = time.time()
+        with self.queue_lock:
+            self.queued += 1
+        try:
+            with self.lock:
+                conn = self._connect()
+                try:
+                    while True:
+                        wait = self._update(conn, 1, tokens)
+                        if wait == 0.0:
+                            break
+                        time.sleep(wait)
+                        waited += wait
+                finally:
+                    conn.close()
+        finally:
+            with self.queue_lock:
+                self.queued -= 1
+        model_stats.record_limiter_wait(self.name, waited)
+        if waited:
+            tracer.record(
+                "limiter_wait",
+                start_time,
+                time.time(),
+                "limiter",
+                limiter=self.name,
+                tokens=tokens,
+            )
+        return waited
+
+    def estimated_wait(self, tokens=0):
+        """Seconds a request of `tokens` tokens would wait if sent now.
+
+        Only reads the buckets, so nothing is consumed. Requests already
+        queued in this process are counted ahead of it; their token costs
+        aren't known, so the estimate is a lower bound when they are large.
+        """
+        tokens = min(tokens, self.tokens_per_minute)
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT requests, tokens, updated FROM buckets WHERE name = ?",
+                (self.name,),
+            ).fetchone()
+        finally:
+            conn.close()
+        requests, available = self._refill(row, time.time())
+        return max(
+            (self.queued + 1 - requests) * 60 / self.requests_per_minute,
+            (tokens - available) * 60 / self.tokens_per_minute,
+            0.0,
+        )
+
+    def adjust(self, tokens):
+        """Correct the token bucket once a request's real usage is known.
+
+        Positive values take more tokens (the bucket may go into debt),
+        negative values hand back an overestimate.
+        """
+        if not tokens:
+            return
+        conn = self._connect()
+        try:
+            self._update(conn, 0, tokens, force=True)
+        finally:
+            conn.close()
+
+    def wait(self):
+        return self.acquire()
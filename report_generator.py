@@ -1,38 +1,33 @@
 import json
-from models import get_gemini_pro_model
+from models import get_final_report_model_text, send_request
+from structured_elements import (
+    merge_structured_elements,
+    parse_structured_elements,
+    split_title,
+)
 
 
-def extract_visual_elements(video_analyses):
-    visual_elements_summary = []
+def structured_slides(video_analyses):
+    # Slides repeated across chunks are listed once
+    analyses = []
     for analysis in video_analyses:
         try:
-            structured_elements = json.loads(analysis).get("structured_elements", [])
-            for element in structured_elements:
-                if element.get("element_type") == "slide":
-                    content = element.get("content", "")
-                    if isinstance(content, str):
-                        title = content.split("\n")[0] if "\n" in content else content
-                        body = (
-                            "\n".join(content.split("\n")[1:])
-                            if "\n" in content
-                            else ""
-                        )
-                    elif isinstance(content, dict):
-                        title = content.get("title", "No title")
-                        body = content.get("text", "")
-                    else:
-                        title = "Unknown format"
-                        body = str(content)
-                    visual_elements_summary.append(f"- {title}\n  {body}")
-        except json.JSONDecodeError:
-            print(f"Error parsing JSON in video analysis. Skipping this chunk.")
-            continue
-        except KeyError as e:
-            print(f"KeyError in video analysis: {str(e)}. Skipping this element.")
-            continue
-        except Exception as e:
-            print(f"Unexpected error in extract_visual_elements: {str(e)}")
-            continue
+            parse_structured_elements(analysis)
+            analyses.append(analysis)
+        except ValueError as e:
+            print(f"Error parsing video analysis: {str(e)}. Skipping this chunk.")
+    return [
+        element
+        for element in merge_structured_elements(analyses)
+        if element["element_type"] == "slide"
+    ]
+
+
+def extract_visual_elements(video_analyses):
+    visual_elements_summary = []
+    for slide in structured_slides(video_analyses):
+        title, body = split_title(slide["content"])
+        visual_elements_summary.append(f"- {title}\n  {body}")
     return "\n\n".join(visual_elements_summary)
 
 
@@ -85,8 +80,8 @@ def generate_markdown_report(
     - Format the output as a properly structured Markdown document, not as JSON.
     """
 
-    model = get_gemini_pro_model()
-    response = model.generate_content(prompt)
+    model = get_final_report_model_text()
+    response = send_request(model, prompt)
 
     try:
         report_data = json.loads(response.text)
@@ -120,39 +115,7 @@ def generate_markdown_report(
 
 def generate_structured_slides_appendix(video_id, video_title, video_analyses):
     markdown_content = "# Appendix A: Structured Slides\n\n"
-    slide_number = 1
-
-    for analysis in video_analyses:
-        try:
-            structured_elements = json.loads(analysis).get("structured_elements", [])
-            for element in structured_elements:
-                if element.get("element_type") == "slide":
-                    content = element.get("content", "")
-                    if isinstance(content, str):
-                        title = content.split("\n")[0] if "\n" in content else content
-                        body = (
-                            "\n".join(content.split("\n")[1:])
-                            if "\n" in content
-                            else ""
-                        )
-                    elif isinstance(content, dict):
-                        title = content.get("title", "No title")
-                        body = content.get("text", "")
-                    else:
-                        title = "Unknown format"
-                        body = str(content)
-                    markdown_content += (
-                        f"## Slide {slide_number}: {title}\n\n{body}\n\n"
-                    )
-                    slide_number += 1
-        except json.JSONDecodeError:
-            print(f"Error parsing JSON in video analysis. Skipping this chunk.")
-            continue
-        except KeyError as e:
-            print(f"KeyError in video analysis: {str(e)}. Skipping this element.")
-            continue
-        except Exception as e:
-            print(f"Unexpected error in extract_visual_elements: {str(e)}")
-            continue
-
+    for slide_number, slide in enumerate(structured_slides(video_analyses), start=1):
+        title, body = split_title(slide["content"])
+        markdown_content += f"## Slide {slide_number}: {title}\n\n{body}\n\n"
     return markdown_content
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", "./cache/responses")
+RESPONSE_CACHE_MAX_MB = float(os.getenv("RESPONSE_CACHE_MAX_MB", "500"))
+RESPONSE_CACHE_MAX_AGE_DAYS = float(os.getenv("RESPONSE_CACHE_MAX_AGE_DAYS", "30"))
+RESPONSE_CACHE_BYPASS = os.getenv("RESPONSE_CACHE_BYPASS", "") == "1"
+
+
+def sha256_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CachedResponse:
+    """Stand-in for a GenerateContentResponse served from the cache."""
+
+    from_cache = True
+    prompt_feedback = None
+    usage_metadata = None
+
+    def __init__(self, text):
+        self.text = text
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        cache_dir=RESPONSE_CACHE_DIR,
+        max_bytes=RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+        max_age=RESPONSE_CACHE_MAX_AGE_DAYS * 24 * 3600,
+        bypass=RESPONSE_CACHE_BYPASS,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.bypass = bypass
+        self.lock = threading.Lock()
+        self.total_bytes = None
+        # Remote file name -> SHA-256 of the local file it was uploaded from
+        self.file_hashes = {}
+
+    def register_file(self, remote_name, content_hash):
+        with self.lock:
+            self.file_hashes[remote_name] = content_hash
+
+    def make_key(self, model, contents):
+        parts = contents if isinstance(contents, list) else [contents]
+        hashed_parts = []
+        for part in parts:
+            if isinstance(part, str):
+                hashed_parts.append("text:" + sha256_text(part))
+            elif isinstance(part, dict) and "data" in part:
+                hashed_parts.append("blob:" + hashlib.sha256(part["data"]).hexdigest())
+            else:
+                # Uploaded files are keyed by the content they were uploaded
+                # from, so re-uploads of the same chunk still hit the cache
+                name = getattr(part, "name", str(part))
+                with self.lock:
+                    content_hash = self.file_hashes.get(name)
+                hashed_parts.append(
+                    "file:" + content_hash if content_hash else "remote:" + name
+                )
+
+        key_material = json.dumps(
+            {
+                "model": model.model_name,
+                "generation_config": getattr(model, "_generation_config", None),
+                "parts": hashed_parts,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return sha256_text(key_material)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        if self.bypass:
+            return None
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return CachedResponse(json.load(f)["text"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key, text):
+        if self.bypass:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"created": time.time(), "text": text}, f)
+        os.replace(tmp_path, path)
+
+        # Only rescan the directory when the running total says we might be
+        # over budget (or on the first write of the process)
+        with self.lock:
+            if self.total_bytes is not None:
+                self.total_bytes += os.path.getsize(path)
+            needs_eviction = (
+                self.total_bytes is None or self.total_bytes > self.max_bytes
+            )
+        if needs_eviction:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        now = time.time()
+        for root, _, files in os.walk(self.cache_dir):
+            for filename in files:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if now - stat.st_mtime > self.max_age:
+                    self._remove(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        # Drop the oldest entries until the cache fits its size budget
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+        with self.lock:
+            self.total_bytes = total
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,305 @@
+import math
+from typing import Dict, List, Tuple
+from models import GEMINI_FLASH_LIMITER
+from model_router import model_router
+from chunk_planner import plan_chunks
+from error_handling import VideoProcessingError
+from token_budget import (
+    CHARS_PER_TOKEN,
+    CONSOLIDATION_TOKEN_BUDGET,
+    IMAGE_TOKEN_ESTIMATE,
+    TRANSCRIPT_TOKEN_BUDGET,
+    VIDEO_TOKENS_PER_SECOND,
+)
+from keyframes import KEYFRAME_INTERVAL, MAX_KEYFRAMES
+from final_report_generator import CONSOLIDATION_FAN_IN, SEMANTIC_INTERTEXTUAL_MERGE
+from utils import get_timed_transcript
+from video_downloader import get_video_info
+from video_processor import FUSED_ANALYSIS, MAX_CONCURRENT_CHUNKS, VIDEO_ANALYSIS_MODE
+
+# Typical response sizes per stage, from past runs. Forecasts of output
+# tokens are only as good as these.
+ESTIMATED_OUTPUT_TOKENS = {
+    "video_analysis": 1_500,
+    "transcript_analysis": 1_200,
+    "intertextual_analysis": 600,
+    "summary": 1_500,
+    "generate_main_content": 3_000,
+    "generate_intertextual_analysis_appendix": 2_000,
+}
+# Work products a fused call returns at once
+FUSED_STAGES = (
+    "video_analysis",
+    "transcript_analysis",
+    "intertextual_analysis",
+    "summary",
+)
+# Instructions around the inputs of each prompt
+PROMPT_TOKENS = 400
+# Consolidation reorganises its input, so output is about the input size up
+# to the model's output limit
+MAX_OUTPUT_TOKENS = 8_192
+
+
+def add_calls(stages, stage, calls, input_tokens, output_tokens):
+    totals = stages.setdefault(
+        stage, {"calls": 0, "input_tokens": 0, "output_tokens": 0}
+    )
+    totals["calls"] += calls
+    totals["input_tokens"] += input_tokens
+    totals["output_tokens"] += output_tokens
+
+
+def batch_sizes(sizes):
+    """split_to_budget over token counts instead of texts."""
+    batches = []
+    current = []
+    for tokens in sizes:
+        if current and (
+            sum(current) + tokens > CONSOLIDATION_TOKEN_BUDGET
+            or len(current) >= CONSOLIDATION_FAN_IN
+        ):
+            batches.append(current)
+            current = []
+        current.append(tokens)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def forecast_consolidation(stages, chunk_count, tokens_per_chunk):
+    """Add the calls of consolidate_chunks' tree reduction; return its output size."""
+    # Over-budget chunks are cut into pieces of at most half the budget
+    piece_budget = CONSOLIDATION_TOKEN_BUDGET // 2
+    pieces = [piece_budget] * (tokens_per_chunk // piece_budget)
+    if tokens_per_chunk % piece_budget or not pieces:
+        pieces.append(tokens_per_chunk % piece_budget or tokens_per_chunk)
+    sizes = pieces * chunk_count
+    while len(sizes) > 1 and len(batch_sizes(sizes)) > 1:
+        batches = batch_sizes(sizes)
+        sizes = []
+        for batch in batches:
+            if len(batch) == 1:
+                sizes.append(batch[0])
+                continue
+            output = min(sum(batch), MAX_OUTPUT_TOKENS)
+            add_calls(
+                stages, "consolidate_batch", 1, sum(batch) + PROMPT_TOKENS, output
+            )
+            sizes.append(output)
+    output = min(sum(sizes), MAX_OUTPUT_TOKENS)
+    add_calls(stages, "consolidate_batch", 1, sum(sizes) + PROMPT_TOKENS, output)
+    return output
+
+
+def forecast_run(
+    duration_seconds: float,
+    transcript_chars: int,
+    chunk_plan: List[Tuple[float, float]],
+    fused: bool = FUSED_ANALYSIS,
+    video_analysis_mode: str = VIDEO_ANALYSIS_MODE,
+    semantic_intertextual: bool = SEMANTIC_INTERTEXTUAL_MERGE,
+) -> Dict:
+    """Predict uploads, model calls and tokens per stage without calling a model.
+
+    Assumes nothing is served from the response cache or a run manifest.
+    """
+    stages: Dict[str, Dict] = {}
+    outputs = ESTIMATED_OUTPUT_TOKENS
+    for chunk_start, chunk_end in chunk_plan:
+        seconds = chunk_end - chunk_start
+        if video_analysis_mode == "keyframes":
+            # Upper bound; duplicate frames are dropped before sending
+            frames = min(math.ceil(seconds / KEYFRAME_INTERVAL), MAX_KEYFRAMES)
+            video_tokens = frames * IMAGE_TOKEN_ESTIMATE
+        else:
+            video_tokens = int(seconds * VIDEO_TOKENS_PER_SECOND)
+        transcript_tokens = min(
+            int(transcript_chars * seconds / duration_seconds) // CHARS_PER_TOKEN,
+            TRANSCRIPT_TOKEN_BUDGET,
+        )
+
+        if fused:
+            add_calls(
+                stages,
+                "fused_analysis",
+                1,
+                video_tokens + transcript_tokens + PROMPT_TOKENS,
+                sum(outputs[stage] for stage in FUSED_STAGES),
+            )
+            continue
+        add_calls(
+            stages,
+            "video_analysis",
+            1,
+            video_tokens + PROMPT_TOKENS,
+            outputs["video_analysis"],
+        )
+        add_calls(
+            stages,
+            "transcript_analysis",
+            1,
+            transcript_tokens + PROMPT_TOKENS,
+            outputs["transcript_analysis"],
+        )
+        add_calls(
+            stages,
+            "intertextual_analysis",
+            1,
+            outputs["video_analysis"] + outputs["transcript_analysis"] + PROMPT_TOKENS,
+            outputs["intertextual_analysis"],
+        )
+        add_calls(
+            stages,
+            "summary",
+            1,
+            outputs["video_analysis"]
+            + outputs["transcript_analysis"]
+            + outputs["intertextual_analysis"]
+            + PROMPT_TOKENS,
+            outputs["summary"],
+        )
+
+    # Final report. Video analysis and intertextual references are merged
+    # locally and the structured elements appendix is rendered locally.
+    chunk_count = len(chunk_plan)
+    consolidated = {
+        "video_analysis": chunk_count * outputs["video_analysis"],
+        "intertextual_analysis": chunk_count * outputs["intertextual_analysis"],
+    }
+    for wp_type in ("transcript_analysis", "summary"):
+        consolidated[wp_type] = forecast_consolidation(
+            stages, chunk_count, outputs[wp_type]
+        )
+    if semantic_intertextual:
+        consolidated["intertextual_analysis"] = forecast_consolidation(
+            stages, 1, consolidated["intertextual_analysis"]
+        )
+    add_calls(
+        stages,
+        "generate_main_content",
+        1,
+        sum(consolidated.values()) + PROMPT_TOKENS,
+        outputs["generate_main_content"],
+    )
+    add_calls(
+        stages,
+        "generate_intertextual_analysis_appendix",
+        1,
+        consolidated["intertextual_analysis"] + PROMPT_TOKENS,
+        outputs["generate_intertextual_analysis_appendix"],
+    )
+
+    return {
+        "duration_seconds": duration_seconds,
+        "chunks": chunk_count,
+        "uploads": 0 if video_analysis_mode == "keyframes" else chunk_count,
+        "stages": stages,
+        "min_wall_seconds": min_wall_seconds(stages),
+    }
+
+
+def forecast_video(video_id, chunk_minutes=None) -> Dict:
+    """Forecast a run of video_id from its metadata and transcript only."""
+    video_title, duration = get_video_info(video_id)
+    if not video_title or not duration:
+        raise VideoProcessingError("Failed to retrieve video information.")
+    chunk_plan = plan_chunks(
+        duration,
+        chunk_minutes * 60 if chunk_minutes else None,
+        parallelism=MAX_CONCURRENT_CHUNKS,
+    )
+    forecast = forecast_run(
+        duration, get_timed_transcript(video_id).char_count, chunk_plan
+    )
+    forecast["title"] = video_title
+    return forecast
+
+
+def merge_forecasts(forecasts: List[Dict]) -> Dict:
+    """One forecast for several runs, e.g. the videos of a batch."""
+    stages: Dict[str, Dict] = {}
+    for forecast in forecasts:
+        for stage, totals in forecast["stages"].items():
+            add_calls(
+                stages,
+                stage,
+                totals["calls"],
+                totals["input_tokens"],
+                totals["output_tokens"],
+            )
+    return {
+        "duration_seconds": sum(f["duration_seconds"] for f in forecasts),
+        "chunks": sum(f["chunks"] for f in forecasts),
+        "uploads": sum(f["uploads"] for f in forecasts),
+        "stages": stages,
+        "min_wall_seconds": min_wall_seconds(stages),
+    }
+
+
+def min_wall_seconds(stages: Dict[str, Dict]) -> Dict[str, float]:
+    """Shortest time each limiter's budget allows for the forecast calls.
+
+    The limiters run side by side, so the run can't finish faster than the
+    largest of these.
+    """
+    usage = {}
+    for stage, totals in stages.items():
+        # Analysis and consolidation run on Flash; the final report tasks
+        # go where their tier policy sends them when the Pro queue is short
+        if stage in model_router.policies:
+            limiter = model_router.planned_limiter(stage)
+        else:
+            limiter = GEMINI_FLASH_LIMITER
+        calls, tokens = usage.get(limiter, (0, 0))
+        usage[limiter] = (calls + totals["calls"], tokens + totals["input_tokens"])
+    return {
+        limiter.name: 60
+        * max(calls / limiter.requests_per_minute, tokens / limiter.tokens_per_minute)
+        for limiter, (calls, tokens) in usage.items()
+    }
+
+
+def format_forecast(forecast: Dict) -> str:
+    report = "Run Forecast:\n\n"
+    if forecast.get("title"):
+        report += f"Video: {forecast['title']}\n"
+    report += f"Video duration: {forecast['duration_seconds'] / 60:.1f} minutes in {forecast['chunks']} chunks\n"
+    report += f"Uploads: {forecast['uploads']}\n\n"
+    report += f"{'Stage':<42} {'Calls':<7} {'Input Tokens':<14} {'Output Tokens':<14}\n"
+    report += "-" * 80 + "\n"
+    for stage, totals in forecast["stages"].items():
+        report += f"{stage:<42} {totals['calls']:<7} {totals['input_tokens']:<14} {totals['output_tokens']:<14}\n"
+    calls = sum(totals["calls"] for totals in forecast["stages"].values())
+    input_tokens = sum(t["input_tokens"] for t in forecast["stages"].values())
+    output_tokens = sum(t["output_tokens"] for t in forecast["stages"].values())
+    report += f"{'Total':<42} {calls:<7} {input_tokens:<14} {output_tokens:<14}\n\n"
+
+    for limiter, seconds in forecast["min_wall_seconds"].items():
+        report += f"Minimum time at {limiter} rate limits: {seconds / 60:.1f} minutes\n"
+    return report
+
+
+def format_comparison(forecast: Dict, actual_stages: Dict[str, Dict]) -> str:
+    """Forecast against model_stats.stage_totals() for the same run.
+
+    Cache hits and stages resumed from a manifest make no calls, so actuals
+    can be lower than the forecast on repeated runs.
+    """
+    report = "Forecast vs Actual:\n\n"
+    report += (
+        f"{'Stage':<42} {'Calls':<13} {'Input Tokens':<21} {'Output Tokens':<21}\n"
+    )
+    report += "-" * 97 + "\n"
+    empty = {"calls": 0, "input_tokens": 0, "output_tokens": 0}
+    for stage in list(forecast["stages"]) + [
+        stage for stage in actual_stages if stage not in forecast["stages"]
+    ]:
+        planned = forecast["stages"].get(stage, empty)
+        actual = actual_stages.get(stage, empty)
+        columns = [
+            f"{planned[field]}/{actual[field]}"
+            for field in ("calls", "input_tokens", "output_tokens")
+        ]
+        report += f"{stage:<42} {columns[0]:<13} {columns[1]:<21} {columns[2]:<21}\n"
+    return report
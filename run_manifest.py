@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from response_cache import sha256_text
+
+
+class RunManifest:
+    """Per-video record of which pipeline stages have completed.
+
+    Stages are keyed by name and, for per-chunk stages, by chunk. A record
+    keeps the hash of the stage's inputs and of the output it wrote, so a
+    restarted run only reuses outputs that still exist unchanged and were
+    produced from the same inputs. The file is rewritten atomically after
+    every update.
+    """
+
+    def __init__(self, path, video_id):
+        self.path = path
+        self.video_id = video_id
+        self.lock = threading.Lock()
+        self.stages = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("video_id") == video_id:
+                self.stages = data.get("stages", {})
+
+    @classmethod
+    def for_video(cls, directory, video_id):
+        return cls(os.path.join(directory, f"manifest_{video_id}.json"), video_id)
+
+    @staticmethod
+    def _key(stage, chunk=None):
+        return stage if chunk is None else f"{stage}:{chunk}"
+
+    def get(self, stage, chunk=None):
+        with self.lock:
+            return self.stages.get(self._key(stage, chunk))
+
+    def completed_output(self, stage, chunk=None, input_hash=None):
+        """Return the saved output of a completed stage, or None to rerun it."""
+        record = self.get(stage, chunk)
+        if record is None or "output_path" not in record:
+            return None
+        if input_hash is not None and record.get("input_hash") != input_hash:
+            return None
+        try:
+            with open(record["output_path"], "r", encoding="utf-8") as f:
+                content = f.read()
+        except OSError:
+            return None
+        if sha256_text(content) != record.get("output_hash"):
+            return None
+        return content
+
+    def mark_complete(
+        self,
+        stage,
+        chunk=None,
+        input_hash=None,
+        output_path=None,
+        content=None,
+        **outputs,
+    ):
+        record = {"completed": time.time(), "outputs": outputs}
+        if input_hash is not None:
+            record["input_hash"] = input_hash
+        if output_path is not None:
+            record["output_path"] = output_path
+            record["output_hash"] = sha256_text(content)
+        with self.lock:
+            self.stages[self._key(stage, chunk)] = record
+            self._save()
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"video_id": self.video_id, "stages": self.stages}, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,91 @@
+import os
+import time
+from artifact_store import ArtifactStore, WHOLE_VIDEO
+
+# Stream model responses and make partial output visible while they arrive
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "") == "1"
+
+# Seconds between progress lines and partial artifact writes for one stream
+PROGRESS_INTERVAL = 1.0
+
+# Partial text is stored under this prefix so readers of the real stage
+# never see an unfinished work product
+PARTIAL_STAGE_PREFIX = "partial:"
+
+
+class StreamWriter:
+    """Collects a streamed response and publishes it as it arrives.
+
+    Pass an instance as send_request's on_text. Each piece is appended to
+    output_file, and the text so far is saved to the artifact store under
+    "partial:<stage>" at most every PROGRESS_INTERVAL seconds. send_request
+    calls reset() before each attempt, so a retried request starts over.
+    Call finish() once the response is complete.
+    """
+
+    def __init__(
+        self,
+        label,
+        output_file=None,
+        interim_dir=None,
+        video_id=None,
+        stage=None,
+        chunk_start=WHOLE_VIDEO,
+        chunk_end=None,
+    ):
+        self.label = label
+        self.output_file = output_file
+        self.store = (
+            ArtifactStore.for_directory(interim_dir)
+            if interim_dir and video_id and stage
+            else None
+        )
+        self.video_id = video_id
+        self.stage = PARTIAL_STAGE_PREFIX + (stage or "")
+        self.chunk_start = WHOLE_VIDEO if chunk_start is None else chunk_start
+        self.chunk_end = chunk_end
+        self.started = time.time()
+        self.reset()
+
+    def reset(self):
+        """Discard the text of an earlier, failed attempt."""
+        self.pieces = []
+        self.characters = 0
+        self.first_piece_at = None
+        self.last_flush = 0.0
+        if self.output_file:
+            open(self.output_file, "w", encoding="utf-8").close()
+
+    def __call__(self, text):
+        now = time.time()
+        if self.first_piece_at is None:
+            self.first_piece_at = now
+            print(f"Debug: {self.label}: first output after {now - self.started:.1f}s")
+        self.pieces.append(text)
+        self.characters += len(text)
+        if self.output_file:
+            with open(self.output_file, "a", encoding="utf-8") as f:
+                f.write(text)
+        if now - self.last_flush >= PROGRESS_INTERVAL:
+            self.last_flush = now
+            print(f"Debug: {self.label}: {self.characters} characters received")
+            if self.store is not None:
+                self.store.put(
+                    self.video_id,
+                    self.stage,
+                    "".join(self.pieces),
+                    self.chunk_start,
+                    self.chunk_end,
+                )
+
+    def finish(self):
+        if self.store is not None:
+            self.store.delete(self.video_id, self.stage, self.chunk_start)
+        print(
+            f"Debug: {self.label}: {self.characters} characters in {time.time() - self.started:.1f}s"
+        )
+
+
+def stream_writer(label, **kwargs):
+    """A StreamWriter when streaming is on, otherwise None."""
+    return StreamWriter(label, **kwargs) if STREAM_RESPONSES else None
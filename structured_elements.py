@@ -0,0 +1,145 @@
+import re
+import json
+from difflib import SequenceMatcher
+
+ELEMENT_TYPES = [
+    "slide",
+    "graph",
+    "chart",
+    "diagram",
+    "table",
+    "code_snippet",
+    "other",
+]
+
+# response_schema for video analysis. Timestamps are MM:SS from the start of
+# the chunk and are shifted to the full video by offset_timestamps.
+STRUCTURED_ELEMENTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "structured_elements": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "element_type": {"type": "string", "enum": ELEMENT_TYPES},
+                    "timestamp": {"type": "string"},
+                    "content": {"type": "string"},
+                },
+                "required": ["element_type", "timestamp", "content"],
+            },
+        }
+    },
+    "required": ["structured_elements"],
+}
+
+# Elements of the same type whose normalized content is at least this similar
+# are the same slide seen again, e.g. in the next chunk or after a cut away
+DUPLICATE_SIMILARITY = 0.9
+
+
+def parse_structured_elements(text):
+    """Return the elements of a video analysis, or raise ValueError.
+
+    Checks the fields the schema requires, since the model does not always
+    honour it.
+    """
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Video analysis is not valid JSON: {str(e)}")
+    if not isinstance(parsed, dict) or not isinstance(
+        parsed.get("structured_elements"), list
+    ):
+        raise ValueError("Video analysis has no structured_elements array")
+    for element in parsed["structured_elements"]:
+        if not isinstance(element, dict) or not all(
+            isinstance(element.get(field), str)
+            for field in ("element_type", "timestamp", "content")
+        ):
+            raise ValueError(f"Malformed structured element: {element}")
+    return parsed["structured_elements"]
+
+
+def parse_timestamp(timestamp):
+    seconds = 0
+    for part in timestamp.strip().split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def format_timestamp(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def offset_timestamps(text, offset_seconds):
+    """Shift chunk-relative timestamps so they are relative to the video."""
+    elements = parse_structured_elements(text)
+    for element in elements:
+        try:
+            element["timestamp"] = format_timestamp(
+                parse_timestamp(element["timestamp"]) + offset_seconds
+            )
+        except ValueError:
+            pass  # Leave free-form timestamps as the model wrote them
+    return json.dumps({"structured_elements": elements}, indent=2)
+
+
+def normalize_content(content):
+    return " ".join(re.sub(r"[^\w\s]", " ", content.lower()).split())
+
+
+def merge_structured_elements(chunks):
+    """Merge per-chunk video analyses, dropping repeated elements.
+
+    Elements keep chunk order. A repeat of an earlier element of the same
+    type is dropped and its timestamp added to the earlier one's
+    `timestamps`. Raises ValueError if a chunk is not structured JSON.
+    """
+    merged = []
+    normalized = []
+    for chunk in chunks:
+        for element in parse_structured_elements(chunk):
+            content = normalize_content(element["content"])
+            for kept, kept_content in zip(merged, normalized):
+                if kept["element_type"] != element["element_type"]:
+                    continue
+                matcher = SequenceMatcher(None, kept_content, content)
+                if (
+                    matcher.real_quick_ratio() >= DUPLICATE_SIMILARITY
+                    and matcher.ratio() >= DUPLICATE_SIMILARITY
+                ):
+                    kept["timestamps"].append(element["timestamp"])
+                    break
+            else:
+                merged.append({**element, "timestamps": [element["timestamp"]]})
+                normalized.append(content)
+
+    print(
+        f"Debug: Merged structured elements from {len(chunks)} chunks into {len(merged)} unique elements"
+    )
+    return merged
+
+
+def split_title(content):
+    lines = content.strip().split("\n")
+    return lines[0], "\n".join(lines[1:]).strip()
+
+
+def render_structured_elements(elements):
+    """Markdown appendix listing each element under its type and timestamps."""
+    sections = []
+    for number, element in enumerate(elements, start=1):
+        title, body = split_title(element["content"])
+        element_type = element["element_type"].replace("_", " ").capitalize()
+        timestamps = ", ".join(element.get("timestamps", [element["timestamp"]]))
+        section = f"### {number}. {element_type}: {title}\n\n*Shown at {timestamps}*"
+        if body:
+            fence = "```" if element["element_type"] == "code_snippet" else ""
+            section += f"\n\n{fence}\n{body}\n{fence}" if fence else f"\n\n{body}"
+        sections.append(section)
+    return "\n\n".join(sections)
@@ -0,0 +1,59 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List
+from model_statistics import model_stats
+from tracing import tracer
+
+
+class TaskGraph:
+    """Runs named tasks on a thread pool as soon as their dependencies finish.
+
+    Each task is called with the results of its dependencies, in the order
+    they were listed. Per-task wall time is recorded in model_stats.
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self.tasks: Dict[str, tuple] = {}
+
+    def add(self, name: str, func: Callable, dependencies: List[str] = ()):
+        self.tasks[name] = (func, list(dependencies))
+
+    def _run_task(self, name: str, func: Callable, args: List[Any]):
+        start_time = time.time()
+        try:
+            with tracer.span(name, "report"):
+                return func(*args)
+        finally:
+            model_stats.record_task(name, start_time, time.time())
+
+    def run(self) -> Dict[str, Any]:
+        for name, (_, dependencies) in self.tasks.items():
+            missing = [d for d in dependencies if d not in self.tasks]
+            if missing:
+                raise ValueError(f"Task {name} depends on unknown tasks: {missing}")
+
+        results: Dict[str, Any] = {}
+        remaining = dict(self.tasks)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while remaining or running:
+                for name, (func, dependencies) in list(remaining.items()):
+                    if all(d in results for d in dependencies):
+                        del remaining[name]
+                        future = executor.submit(
+                            self._run_task,
+                            name,
+                            func,
+                            [results[d] for d in dependencies],
+                        )
+                        running[future] = name
+                if not running:
+                    raise ValueError(
+                        f"Dependency cycle between tasks: {sorted(remaining)}"
+                    )
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        return results
@@ -0,0 +1,114 @@
+import os
+from typing import List
+
+CHARS_PER_TOKEN = 4
+
+# Uploaded chunks are billed by duration, roughly 263 tokens per second of
+# video, so a 10-minute chunk is about 158k tokens
+VIDEO_TOKENS_PER_SECOND = 263
+# Used for files whose duration the caller doesn't pass
+FILE_TOKEN_ESTIMATE = 10 * 60 * VIDEO_TOKENS_PER_SECOND
+# Inline images are billed at a flat rate
+IMAGE_TOKEN_ESTIMATE = 258
+
+# Ask the API for an exact count before each request instead of estimating.
+# count_tokens has its own quota, but it is still an extra round trip.
+PREFLIGHT_TOKEN_COUNT = os.getenv("PREFLIGHT_TOKEN_COUNT", "") == "1"
+
+# Per-call input budgets. Model context limits are far larger, but output
+# quality and latency fall off well before them.
+TRANSCRIPT_TOKEN_BUDGET = 60_000
+CONSOLIDATION_TOKEN_BUDGET = 100_000
+
+
+def estimate_tokens(contents, file_seconds: float = None) -> int:
+    """Estimate the input tokens of contents.
+
+    file_seconds is the length of the uploaded video among the contents, if
+    known; without it a file counts as FILE_TOKEN_ESTIMATE.
+    """
+    parts = contents if isinstance(contents, list) else [contents]
+    tokens = 0
+    for part in parts:
+        if isinstance(part, str):
+            tokens += len(part) // CHARS_PER_TOKEN
+        elif isinstance(part, dict) and "data" in part:
+            tokens += IMAGE_TOKEN_ESTIMATE
+        elif file_seconds is not None:
+            tokens += int(file_seconds * VIDEO_TOKENS_PER_SECOND)
+        else:
+            tokens += FILE_TOKEN_ESTIMATE
+    return tokens
+
+
+def count_tokens(model, contents, file_seconds: float = None) -> int:
+    if not PREFLIGHT_TOKEN_COUNT:
+        return estimate_tokens(contents, file_seconds)
+    try:
+        return model.count_tokens(contents).total_tokens
+    except Exception as e:
+        print(f"Warning: token count failed, falling back to estimate: {str(e)}")
+        return estimate_tokens(contents, file_seconds)
+
+
+def trim_to_budget(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    print(
+        f"Debug: Trimming input from ~{len(text) // CHARS_PER_TOKEN} to {max_tokens} tokens"
+    )
+    return text[:max_chars]
+
+
+def split_to_budget(
+    texts: List[str], max_tokens: int, max_items: int = None
+) -> List[List[str]]:
+    """Group adjacent texts into batches whose estimated size fits max_tokens.
+
+    Order is preserved. A single text larger than the budget becomes a batch
+    of its own rather than being cut. max_items caps the texts per batch.
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and (
+            current_tokens + tokens > max_tokens
+            or (max_items and len(current) >= max_items)
+        ):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def split_text_to_budget(text: str, max_tokens: int) -> List[str]:
+    """Cut text into pieces of at most max_tokens, at paragraph breaks.
+
+    A paragraph larger than the budget on its own is cut at the budget.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return [text]
+    pieces = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and len(current) + 2 + len(paragraph) > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        pieces.append(current)
+    return pieces
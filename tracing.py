@@ -0,0 +1,159 @@
+import os
+import json
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Write a Chrome trace (chrome://tracing or ui.perfetto.dev) here after a run
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+
+
+class Span:
+    def __init__(self, name, category, attributes):
+        self.name = name
+        self.category = category
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """Collects timed spans from every thread of a run.
+
+    Spans opened with span() nest by time within a thread, which is how the
+    trace viewer draws them. record() adds a span whose start and end are
+    already known, e.g. time a file spent processing on the service.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.spans = []
+            self.thread_names = {}
+            self.origin = time.time()
+
+    @contextmanager
+    def span(self, name, category="pipeline", **attributes):
+        span = Span(name, category, attributes)
+        start_time = time.time()
+        try:
+            yield span
+        except Exception as e:
+            span.set(error=f"{type(e).__name__}: {str(e)}")
+            raise
+        finally:
+            self.record(name, start_time, time.time(), category, **span.attributes)
+
+    def record(self, name, start_time, end_time, category="pipeline", **attributes):
+        thread = threading.current_thread()
+        with self.lock:
+            self.thread_names[thread.ident] = thread.name
+            self.spans.append(
+                {
+                    "name": name,
+                    "category": category,
+                    "start_time": start_time,
+                    "end_time": end_time,
+                    "thread": thread.ident,
+                    "attributes": attributes,
+                }
+            )
+
+    def traced(self, name=None, category="pipeline"):
+        """Decorator that wraps each call of a function in a span."""
+
+        def decorator(func):
+            span_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name, category):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def chrome_trace(self):
+        with self.lock:
+            spans = list(self.spans)
+            thread_names = dict(self.thread_names)
+            origin = self.origin
+
+        pid = os.getpid()
+        events = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": thread_name},
+            }
+            for tid, thread_name in thread_names.items()
+        ]
+        for span in spans:
+            events.append(
+                {
+                    "name": span["name"],
+                    "cat": span["category"],
+                    "ph": "X",
+                    "ts": (span["start_time"] - origin) * 1_000_000,
+                    "dur": (span["end_time"] - span["start_time"]) * 1_000_000,
+                    "pid": pid,
+                    "tid": span["thread"],
+                    "args": span["attributes"],
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f, default=str)
+        print(f"Trace written to {path}")
+
+    def latency_summary(self):
+        """Count, total, p50, p95 and max seconds per span name."""
+        durations = {}
+        with self.lock:
+            for span in self.spans:
+                durations.setdefault(span["name"], []).append(
+                    span["end_time"] - span["start_time"]
+                )
+
+        summary = {}
+        for name, values in durations.items():
+            values.sort()
+            summary[name] = {
+                "count": len(values),
+                "total": sum(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "max": values[-1],
+            }
+        return summary
+
+    def format_summary(self):
+        summary = self.latency_summary()
+        report = "Stage Latency:\n\n"
+        report += f"{'Span':<36} {'Count':<7} {'Total (s)':<11} {'p50 (s)':<9} {'p95 (s)':<9} {'Max (s)':<9}\n"
+        report += "-" * 84 + "\n"
+        for name, stats in sorted(
+            summary.items(), key=lambda item: item[1]["total"], reverse=True
+        ):
+            report += f"{name:<36} {stats['count']:<7} {stats['total']:<11.2f} {stats['p50']:<9.2f} {stats['p95']:<9.2f} {stats['max']:<9.2f}\n"
+        return report
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile of an already sorted list
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+tracer = Tracer()
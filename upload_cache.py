@@ -0,0 +1,81 @@
+import os
+import sqlite3
+import time
+
+UPLOAD_CACHE_DB = os.getenv("UPLOAD_CACHE_DB", "./cache/uploads.sqlite3")
+
+# The File API deletes uploads after 48 hours. Entries without an expiry from
+# the service are assumed to last a little less than that.
+DEFAULT_FILE_LIFETIME = 47 * 3600
+# Don't hand out a file that could expire before the analysis is sent
+EXPIRY_MARGIN = 3600
+
+
+def expiry_of(video_file):
+    expiration = getattr(video_file, "expiration_time", None)
+    if expiration is not None and hasattr(expiration, "timestamp"):
+        return expiration.timestamp()
+    return time.time() + DEFAULT_FILE_LIFETIME
+
+
+class UploadCache:
+    """Remote files by the SHA-256 of the content they were uploaded from.
+
+    Shared by every run and process on the machine, so the same chunk is
+    uploaded once per File API lifetime no matter which run needs it.
+    """
+
+    def __init__(self, db_path=UPLOAD_CACHE_DB):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS uploads ("
+                "content_hash TEXT PRIMARY KEY, name TEXT NOT NULL, "
+                "uri TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get(self, content_hash):
+        """Return the remote file name for content_hash, or None."""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT name FROM uploads WHERE content_hash = ? AND expires > ?",
+                (content_hash, time.time() + EXPIRY_MARGIN),
+            ).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def put(self, content_hash, video_file):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?)",
+                    (
+                        content_hash,
+                        video_file.name,
+                        video_file.uri,
+                        expiry_of(video_file),
+                    ),
+                )
+                conn.execute("DELETE FROM uploads WHERE expires <= ?", (time.time(),))
+        finally:
+            conn.close()
+
+    def remove(self, content_hash):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "DELETE FROM uploads WHERE content_hash = ?", (content_hash,)
+                )
+        finally:
+            conn.close()
+
+
+upload_cache = UploadCache()
@@ -1,4 +1,6 @@
 import os
+from array import array
+from bisect import bisect_left
 from youtube_transcript_api import YouTubeTranscriptApi
 
 
@@ -7,10 +9,49 @@ def setup_directories(directories):
         os.makedirs(dir_path, exist_ok=True)
 
 
-def get_transcript(video_id):
+class TimedTranscript:
+    """Transcript entries with their start times kept in parallel arrays.
+
+    Entries are ordered by start time, so the text spoken in any time range
+    is found with two binary searches.
+    """
+
+    def __init__(self, entries=()):
+        self.starts = array("d")
+        self.durations = array("d")
+        self.texts = []
+        for entry in sorted(entries, key=lambda e: e["start"]):
+            self.starts.append(entry["start"])
+            self.durations.append(entry.get("duration", 0.0))
+            self.texts.append(entry["text"])
+        self.char_count = sum(len(text) for text in self.texts) + max(
+            len(self.texts) - 1, 0
+        )
+
+    def __bool__(self):
+        return bool(self.texts)
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def text(self):
+        return " ".join(self.texts)
+
+    def slice(self, start_seconds, end_seconds):
+        # An entry belongs to the range its start time falls in
+        lo = bisect_left(self.starts, start_seconds)
+        hi = bisect_left(self.starts, end_seconds, lo)
+        return " ".join(self.texts[lo:hi])
+
+
+def get_timed_transcript(video_id):
     try:
-        transcript = YouTubeTranscriptApi.get_transcript(video_id)
-        return " ".join([entry["text"] for entry in transcript])
+        return TimedTranscript(YouTubeTranscriptApi.get_transcript(video_id))
     except Exception as e:
         print(f"Error fetching transcript: {e}")
-        return ""
+        return TimedTranscript()
+
+
+def get_transcript(video_id):
+    return get_timed_transcript(video_id).text
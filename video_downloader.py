@@ -1,8 +1,20 @@
 import yt_dlp
 import os
+import csv
+import shutil
+import subprocess
+import tempfile
+import time
 from pytube import YouTube
 from moviepy.editor import VideoFileClip
 from moviepy.video.io.ffmpeg_tools import ffmpeg_extract_subclip
+from error_handling import VideoProcessingError
+from response_cache import sha256_file
+from chunk_planner import plan_chunks
+from tracing import tracer
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+SEGMENT_POLL_INTERVAL = 0.5
 
 
 def get_video_info(video_id):
@@ -14,28 +26,188 @@ def get_video_info(video_id):
         return None, None
 
 
-def download_youtube_video(
-    video_id, output_dir, chunk_duration=10 * 60
-):  # Default to 10 minutes
+def chunk_filename_for(filename, start, end):
+    return f"{os.path.splitext(filename)[0]}_chunk_{int(start//60):03d}-{int(end//60):03d}.mp4"
+
+
+@tracer.traced("download")
+def fetch_youtube_video(video_id, output_dir):
     url = f"https://www.youtube.com/watch?v={video_id}"
     ydl_opts = {
         "format": "bestvideo[ext=mp4][height<=720]+bestaudio[ext=m4a]/best[ext=mp4]/best",
         "outtmpl": os.path.join(output_dir, "%(title)s.%(ext)s"),
     }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=True)
+        filename = ydl.prepare_filename(info)
+    print(f"Video successfully downloaded to {filename}")
+    return filename
+
+
+def read_segment_list(segment_list):
+    # ffmpeg appends "name,start,end" once a segment is complete, quoting
+    # names that contain a comma or a quote; ignore a trailing line that is
+    # still being written
+    if not os.path.exists(segment_list):
+        return []
+    with open(segment_list, "r", encoding="utf-8", newline="") as f:
+        lines = f.read().split("\n")[:-1]
+    return [(name, float(start), float(end)) for name, start, end in csv.reader(lines)]
+
+
+def segment_video_stream_copy(filename, chunk_plan, remove_source=True):
+    """Split a video into chunks in a single ffmpeg stream-copy pass.
+
+    chunk_plan is a list of (start, end) seconds from chunk_planner. Cuts
+    land on the first keyframe at or after each chunk boundary. Yields
+    (path, start, end) for each chunk as soon as ffmpeg finishes writing it,
+    with the start and end seconds where the cuts actually landed.
+    """
+    # Segments are written under a fixed pattern in a directory of their own,
+    # since the title in filename may contain "%", which the segment muxer
+    # would read as part of its template
+    segment_dir = tempfile.mkdtemp(prefix="segments_", dir=os.path.dirname(filename))
+    segment_list = os.path.join(segment_dir, "segments.csv")
+
+    command = [
+        FFMPEG_BINARY,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        filename,
+        "-map",
+        "0",
+        "-c",
+        "copy",
+        "-f",
+        "segment",
+        "-segment_times",
+        ",".join(f"{end:.3f}" for _, end in chunk_plan[:-1]) or "0",
+        "-reset_timestamps",
+        "1",
+        "-segment_list",
+        segment_list,
+        "-segment_list_type",
+        "csv",
+        os.path.join(segment_dir, "segment_%03d.mp4"),
+    ]
+    # Recorded at the end rather than as an open span, since the consumer
+    # does its own work between chunks
+    start_time = time.time()
+    process = subprocess.Popen(command)
+    yielded = 0
+    try:
+        while True:
+            finished = process.poll() is not None
+            entries = read_segment_list(segment_list)
+            for name, start, end in entries[yielded:]:
+                chunk_filename = chunk_filename_for(filename, start, end)
+                os.replace(
+                    os.path.join(segment_dir, os.path.basename(name)), chunk_filename
+                )
+                print(f"Created chunk: {chunk_filename}")
+                yield chunk_filename, start, end
+            yielded = len(entries)
+            if finished:
+                break
+            time.sleep(SEGMENT_POLL_INTERVAL)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        if process.returncode != 0:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+
+    tracer.record(
+        "split", start_time, time.time(), chunks=yielded, returncode=process.returncode
+    )
+    if process.returncode != 0:
+        raise VideoProcessingError(
+            f"ffmpeg segmenting failed with exit code {process.returncode}"
+        )
+
+    shutil.rmtree(segment_dir)
+    if remove_source:
+        os.remove(filename)
+        print(f"Removed original file: {filename}")
+
+
+def iter_youtube_video_chunks(video_id, output_dir, chunk_plan, manifest=None):
+    """Yield (path, start, end) for each chunk, as segment_video_stream_copy."""
+    if manifest is None:
+        filename = fetch_youtube_video(video_id, output_dir)
+        yield from segment_video_stream_copy(filename, chunk_plan)
+        return
+
+    # Resume from whatever an earlier run left behind, unless it was split
+    # with a different plan
+    plan = [list(bounds) for bounds in chunk_plan]
+    split = manifest.get("split")
+    if (
+        split
+        and split["outputs"].get("plan") == plan
+        and all(os.path.exists(path) for path in split["outputs"]["chunks"])
+    ):
+        print("Resuming: video already downloaded and split")
+        # Splits recorded before the actual bounds were kept fall back to the
+        # plan
+        bounds = split["outputs"].get("bounds", plan)
+        for path, (start, end) in zip(split["outputs"]["chunks"], bounds):
+            yield path, start, end
+        return
+
+    download = manifest.get("download")
+    if download and os.path.exists(download["outputs"]["filename"]):
+        filename = download["outputs"]["filename"]
+        print(f"Resuming: video already downloaded to {filename}")
+    else:
+        filename = fetch_youtube_video(video_id, output_dir)
+        manifest.mark_complete(
+            "download", filename=filename, size=os.path.getsize(filename)
+        )
+
+    chunks = []
+    bounds = []
+    for i, (chunk_filename, start, end) in enumerate(
+        segment_video_stream_copy(filename, chunk_plan)
+    ):
+        manifest.mark_complete(
+            "split",
+            i,
+            path=chunk_filename,
+            sha256=sha256_file(chunk_filename),
+            start=start,
+            end=end,
+        )
+        chunks.append(chunk_filename)
+        bounds.append([start, end])
+        yield chunk_filename, start, end
+    manifest.mark_complete("split", chunks=chunks, plan=plan, bounds=bounds)
+
+
+def download_youtube_video(video_id, output_dir, chunk_plan=None, stream_copy=True):
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
-        print(f"Video successfully downloaded to {filename}")
+        if chunk_plan is None:
+            _, duration = get_video_info(video_id)
+            chunk_plan = plan_chunks(duration)
+        if stream_copy:
+            return [
+                path
+                for path, _, _ in iter_youtube_video_chunks(
+                    video_id, output_dir, chunk_plan
+                )
+            ]
+
+        filename = fetch_youtube_video(video_id, output_dir)
 
         # Split the video into chunks
         video = VideoFileClip(filename)
-        duration = video.duration
         chunks = []
-        for i in range(0, int(duration), chunk_duration):
-            start = i
-            end = min(i + chunk_duration, duration)
-            chunk_filename = f"{os.path.splitext(filename)[0]}_chunk_{int(i//60):03d}-{int(end//60):03d}.mp4"
+        for start, end in chunk_plan:
+            end = min(end, video.duration)
+            chunk_filename = chunk_filename_for(filename, start, end)
             ffmpeg_extract_subclip(filename, start, end, targetname=chunk_filename)
             chunks.append(chunk_filename)
             print(f"Created chunk: {chunk_filename}")
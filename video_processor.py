@@ -1,107 +1,466 @@
-from file_uploader import upload_video, wait_for_file_active
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from file_uploader import UploadManager
 from content_generator import (
+    INTERIM_DIR,
+    ANALYSIS_ERROR_PREFIX,
+    FUSED_WORK_PRODUCT_TYPES,
+    analyze_chunk_fused,
     analyze_combined_video_and_transcript_wp,
     analyze_video_content,
     analyze_transcript,
     save_interim_work_product,
 )
-from utils import get_transcript
+from utils import get_timed_transcript
 from error_handling import handle_exceptions, VideoProcessingError
 from prompt_logic_intertextual import analyze_intertextual_references
-import time
+from response_cache import sha256_text
+from artifact_store import ArtifactStore
+from keyframes import (
+    DUPLICATE_THRESHOLD,
+    HASH_SIZE,
+    KEYFRAME_INTERVAL,
+    MAX_KEYFRAMES,
+    extract_keyframes,
+    keyframe_parts,
+)
+from proxy_transcode import PROXY_PRESET
+from streaming import stream_writer
+from tracing import tracer
 
+# Number of chunks analysed at the same time. The Gemini rate limiters are
+# shared between threads, so this only bounds how many requests are in flight.
+MAX_CONCURRENT_CHUNKS = 4
 
-@handle_exceptions
-def process_video(video_chunks, video_id, video_title, duration_minutes):
-    transcript = get_transcript(video_id)
-    if not transcript:
-        raise VideoProcessingError("Unable to retrieve transcript")
+# "upload" sends each chunk through the File API. "keyframes" extracts the
+# distinct frames locally and sends them as images, which is much smaller for
+# slide-heavy talks but loses motion and audio.
+VIDEO_ANALYSIS_MODE = os.getenv("VIDEO_ANALYSIS_MODE", "upload")
 
-    print(f"Successfully retrieved transcript ({len(transcript)} characters).")
+# Produce each chunk's four work products with one request instead of four
+FUSED_ANALYSIS = os.getenv("FUSED_ANALYSIS", "") == "1"
 
-    summary_chunks = []
-    intertextual_chunks = []
-    video_analyses = []
 
-    for i, chunk_path in enumerate(video_chunks):
-        try:
-            chunk_start = i * 10
-            chunk_end = min((i + 1) * 10, duration_minutes)
-            chunk_transcript = transcript[
-                int(chunk_start * 60 * 10) : int(chunk_end * 60 * 10)
-            ]
+def chunk_bounds(i, chunk_plan):
+    # Chunk boundaries are planned in seconds but keyed in minutes
+    chunk_start, chunk_end = chunk_plan[i]
+    return chunk_start / 60, chunk_end / 60
 
-            print(f"Processing chunk {chunk_start:03.0f}-{chunk_end:03.0f} minutes...")
 
-            # Upload and process video chunk
-            video_file = upload_video(chunk_path)
-            video_file = wait_for_file_active(video_file)
+def chunk_key(chunk_start, chunk_end):
+    return f"{chunk_start:03.0f}_{chunk_end:03.0f}"
 
-            # Analyze video content
-            video_analysis = analyze_video_content(video_file, chunk_start, chunk_end)
-            save_interim_work_product(
-                video_analysis,
-                video_id,
-                video_title,
-                f"video_analysis_chunk_{chunk_start:03.0f}_{chunk_end:03.0f}",
-            )
-            video_analyses.append(video_analysis)
 
-            # Analyze transcript
-            transcript_analysis = analyze_transcript(
-                chunk_transcript, chunk_start, chunk_end
+def run_stage(
+    manifest,
+    work_product_type,
+    chunk_start,
+    chunk_end,
+    input_hash,
+    video_id,
+    video_title,
+    compute,
+    interim_dir=INTERIM_DIR,
+):
+    chunk = chunk_key(chunk_start, chunk_end)
+    # Reuse the saved work product when a previous run completed this stage
+    # from the same inputs
+    if manifest is not None:
+        content = manifest.completed_output(
+            work_product_type, chunk, input_hash=input_hash
+        )
+        if content is not None:
+            print(f"Resuming: {work_product_type} for chunk {chunk} already complete")
+            ArtifactStore.for_directory(interim_dir).put(
+                video_id, work_product_type, content, chunk_start, chunk_end
             )
-            save_interim_work_product(
-                transcript_analysis,
-                video_id,
-                video_title,
-                f"transcript_analysis_chunk_{chunk_start:03.0f}_{chunk_end:03.0f}",
+            return content
+
+    # compute is called with an on_text callback for streaming, or None
+    writer = stream_writer(
+        f"{work_product_type} {chunk}",
+        interim_dir=interim_dir,
+        video_id=video_id,
+        stage=work_product_type,
+        chunk_start=chunk_start,
+        chunk_end=chunk_end,
+    )
+    try:
+        with tracer.span(work_product_type, "stage", chunk=chunk):
+            content = compute(writer)
+    finally:
+        if writer is not None:
+            writer.finish()
+    filename = save_interim_work_product(
+        content,
+        video_id,
+        video_title,
+        work_product_type,
+        chunk_start,
+        chunk_end,
+        interim_dir,
+    )
+    if manifest is not None and not content.startswith(ANALYSIS_ERROR_PREFIX):
+        manifest.mark_complete(
+            work_product_type,
+            chunk,
+            input_hash=input_hash,
+            output_path=os.path.join(interim_dir, filename),
+            content=content,
+        )
+    return content
+
+
+def split_hash(manifest, i):
+    record = manifest.get("split", i) if manifest is not None else None
+    return record["outputs"].get("sha256") if record else None
+
+
+def fused_input_hash(video_hash, chunk_transcript):
+    return sha256_text(f"fused:{video_hash}:{sha256_text(chunk_transcript)}")
+
+
+def load_video_source(upload_future, keyframe_source, chunk_start, chunk_end):
+    """Return (video_file, keyframe_parts) for a chunk's video analysis.
+
+    keyframe_source is the local chunk file when analysing keyframes;
+    otherwise this waits for the upload to become ACTIVE.
+    """
+    if keyframe_source is not None:
+        keyframes = extract_keyframes(keyframe_source, (chunk_end - chunk_start) * 60)
+        return None, keyframe_parts(keyframes)
+    return upload_future.result(), None
+
+
+def process_chunk(
+    i,
+    upload_future,
+    transcript,
+    video_id,
+    video_title,
+    chunk_plan,
+    manifest,
+    interim_dir=INTERIM_DIR,
+    keyframe_source=None,
+    fused=False,
+    video_bounds=None,
+):
+    # The planned bounds identify the chunk in the manifest and the store.
+    # video_bounds are the minutes the chunk file actually covers, since
+    # stream-copy cuts land on keyframes; the transcript slice and timestamps
+    # follow those.
+    chunk_start, chunk_end = chunk_bounds(i, chunk_plan)
+    video_start, video_end = video_bounds or (chunk_start, chunk_end)
+    start_time = time.time()
+    try:
+        chunk_transcript = transcript.slice(video_start * 60, video_end * 60)
+
+        print(f"Processing chunk {chunk_start:03.0f}-{chunk_end:03.0f} minutes...")
+
+        video_hash = split_hash(manifest, i)
+        if keyframe_source is not None and video_hash:
+            # The frames sent depend on the sampling and dedup settings too
+            video_hash = sha256_text(
+                f"keyframes:{KEYFRAME_INTERVAL}:{MAX_KEYFRAMES}:{HASH_SIZE}:"
+                f"{DUPLICATE_THRESHOLD}:" + video_hash
             )
 
-            # Perform intertextual analysis
-            intertextual_analysis = analyze_intertextual_references(
-                video_analysis, transcript_analysis, chunk_start, chunk_end
+        if fused:
+            # One request produces all four work products; each is still
+            # saved and checkpointed as its own stage
+            fused_hash = fused_input_hash(video_hash, chunk_transcript)
+            sections = {}
+
+            def fused_section(work_product_type):
+                def compute(on_text):
+                    if not sections:
+                        video_file, parts = load_video_source(
+                            upload_future, keyframe_source, video_start, video_end
+                        )
+                        sections.update(
+                            analyze_chunk_fused(
+                                video_file,
+                                chunk_transcript,
+                                video_start,
+                                video_end,
+                                parts,
+                                on_text,
+                            )
+                        )
+                    return sections[work_product_type]
+
+                return compute
+
+            video_analysis, transcript_analysis, intertextual_analysis, summary = [
+                run_stage(
+                    manifest,
+                    work_product_type,
+                    chunk_start,
+                    chunk_end,
+                    fused_hash,
+                    video_id,
+                    video_title,
+                    fused_section(work_product_type),
+                    interim_dir,
+                )
+                for work_product_type in FUSED_WORK_PRODUCT_TYPES
+            ]
+            return summary, intertextual_analysis, video_analysis
+
+        # The transcript does not depend on the upload, so analyse it while
+        # the video chunk is still being processed by the File API
+        transcript_analysis = run_stage(
+            manifest,
+            "transcript_analysis",
+            chunk_start,
+            chunk_end,
+            sha256_text(chunk_transcript),
+            video_id,
+            video_title,
+            lambda on_text: analyze_transcript(
+                chunk_transcript, video_start, video_end, on_text
+            ),
+            interim_dir,
+        )
+
+        # Analyze video content once the upload is ACTIVE or the keyframes
+        # are extracted
+        def analyze_video(on_text):
+            video_file, parts = load_video_source(
+                upload_future, keyframe_source, video_start, video_end
             )
-            save_interim_work_product(
-                intertextual_analysis,
-                video_id,
-                video_title,
-                f"intertextual_analysis_chunk_{chunk_start:03.0f}_{chunk_end:03.0f}",
+            return analyze_video_content(
+                video_file, video_start, video_end, parts, on_text
             )
 
-            # Generate combined summary
-            summary = analyze_combined_video_and_transcript_wp(
+        video_analysis = run_stage(
+            manifest,
+            "video_analysis",
+            chunk_start,
+            chunk_end,
+            video_hash,
+            video_id,
+            video_title,
+            analyze_video,
+            interim_dir,
+        )
+
+        # Perform intertextual analysis
+        intertextual_analysis = run_stage(
+            manifest,
+            "intertextual_analysis",
+            chunk_start,
+            chunk_end,
+            sha256_text(video_analysis + transcript_analysis),
+            video_id,
+            video_title,
+            lambda on_text: analyze_intertextual_references(
+                video_analysis, transcript_analysis, video_start, video_end, on_text
+            ),
+            interim_dir,
+        )
+
+        # Generate combined summary
+        summary = run_stage(
+            manifest,
+            "summary",
+            chunk_start,
+            chunk_end,
+            sha256_text(video_analysis + transcript_analysis + intertextual_analysis),
+            video_id,
+            video_title,
+            lambda on_text: analyze_combined_video_and_transcript_wp(
                 video_analysis,
                 transcript_analysis,
                 intertextual_analysis,
-                chunk_start,
-                chunk_end,
-                video_id,
-                video_title,
-            )
-            summary_chunks.append(summary)
-            save_interim_work_product(
-                summary,
+                video_start,
+                video_end,
                 video_id,
                 video_title,
-                f"summary_chunk_{chunk_start:03.0f}_{chunk_end:03.0f}",
+                on_text,
+            ),
+            interim_dir,
+        )
+
+        return summary, intertextual_analysis, video_analysis
+
+    except Exception as e:
+        print(f"Error processing chunk {i+1}: {str(e)}")
+        error_content = f"Error in chunk {i+1}: {str(e)}"
+        save_interim_work_product(
+            error_content,
+            video_id,
+            video_title,
+            "error",
+            chunk_start,
+            chunk_end,
+            interim_dir,
+        )
+        return None
+    finally:
+        tracer.record(
+            "process_chunk",
+            start_time,
+            time.time(),
+            chunk=chunk_key(chunk_start, chunk_end),
+        )
+
+
+def submit_upload(
+    upload_manager,
+    manifest,
+    i,
+    chunk_path,
+    chunk_plan,
+    transcript=None,
+    fused=False,
+    video_bounds=None,
+):
+    """Start the upload for a chunk, or return None if it isn't needed.
+
+    The upload is skipped only when every stage that reads the video is
+    complete under the input hash process_chunk will check it with.
+    """
+    if manifest is None:
+        return upload_manager.submit(chunk_path)
+
+    chunk_start, chunk_end = chunk_bounds(i, chunk_plan)
+    chunk = chunk_key(chunk_start, chunk_end)
+    chunk_hash = split_hash(manifest, i)
+    if fused:
+        video_start, video_end = video_bounds or (chunk_start, chunk_end)
+        video_stages = FUSED_WORK_PRODUCT_TYPES
+        stage_hash = fused_input_hash(
+            chunk_hash, transcript.slice(video_start * 60, video_end * 60)
+        )
+    else:
+        video_stages = ["video_analysis"]
+        stage_hash = chunk_hash
+    if all(
+        manifest.completed_output(stage, chunk, input_hash=stage_hash) is not None
+        for stage in video_stages
+    ):
+        return None
+
+    # A file uploaded by an earlier run may still be on the File API
+    record = manifest.get("upload", chunk)
+    remote_name = None
+    if (
+        record
+        and chunk_hash
+        and record.get("input_hash") == chunk_hash
+        and record["outputs"].get("proxy_preset", "") == upload_manager.proxy_preset
+    ):
+        remote_name = record["outputs"]["name"]
+    future = upload_manager.submit(chunk_path, remote_name=remote_name)
+
+    def record_upload(future):
+        if future.exception() is None:
+            manifest.mark_complete(
+                "upload",
+                chunk,
+                input_hash=chunk_hash,
+                name=future.result().name,
+                uri=future.result().uri,
+                proxy_preset=upload_manager.proxy_preset,
             )
 
-            intertextual_chunks.append(intertextual_analysis)
+    future.add_done_callback(record_upload)
+    return future
 
-        except Exception as e:
-            print(f"Error processing chunk {i+1}: {str(e)}")
-            error_content = f"Error in chunk {i+1}: {str(e)}"
-            save_interim_work_product(
-                error_content,
-                video_id,
-                video_title,
-                f"error_chunk_{chunk_start:03.0f}_{chunk_end:03.0f}",
+
+@handle_exceptions
+@tracer.traced()
+def process_video(
+    video_chunks,
+    video_id,
+    video_title,
+    chunk_plan,
+    max_workers=MAX_CONCURRENT_CHUNKS,
+    manifest=None,
+    interim_dir=INTERIM_DIR,
+    transcript=None,
+    video_analysis_mode=VIDEO_ANALYSIS_MODE,
+    proxy_preset=PROXY_PRESET,
+    fused=FUSED_ANALYSIS,
+):
+    """Analyse every chunk of a video.
+
+    chunk_plan holds the planned (start, end) seconds of each chunk, in the
+    order video_chunks yields them. video_chunks yields (path, start, end)
+    with the seconds each chunk file actually covers.
+    """
+    if transcript is None:
+        transcript = get_timed_transcript(video_id)
+    if not transcript:
+        raise VideoProcessingError("Unable to retrieve transcript")
+
+    print(
+        f"Successfully retrieved transcript ({transcript.char_count} characters, {len(transcript)} entries)."
+    )
+
+    # Drop chunk work products a run with a different chunk plan left behind
+    ArtifactStore.for_directory(interim_dir).retain_chunks(
+        video_id, [chunk_bounds(i, chunk_plan) for i in range(len(chunk_plan))]
+    )
+
+    summary_chunks = []
+    intertextual_chunks = []
+    video_analyses = []
+
+    # All chunks are handed to the upload manager up front; each chunk's
+    # analysis waits only on its own file becoming ACTIVE. Pass max_workers=1
+    # to analyse the chunks one after another.
+    with (
+        UploadManager(proxy_preset=proxy_preset) as upload_manager,
+        ThreadPoolExecutor(max_workers=max_workers) as chunk_executor,
+    ):
+        chunk_futures = []
+        for i, (chunk_path, video_start, video_end) in enumerate(video_chunks):
+            video_bounds = (video_start / 60, video_end / 60)
+            use_keyframes = video_analysis_mode == "keyframes"
+            upload_future = (
+                None
+                if use_keyframes
+                else submit_upload(
+                    upload_manager,
+                    manifest,
+                    i,
+                    chunk_path,
+                    chunk_plan,
+                    transcript,
+                    fused,
+                    video_bounds,
+                )
             )
-            continue  # Move to the next chunk
+            chunk_futures.append(
+                chunk_executor.submit(
+                    process_chunk,
+                    i,
+                    upload_future,
+                    transcript,
+                    video_id,
+                    video_title,
+                    chunk_plan,
+                    manifest,
+                    interim_dir,
+                    chunk_path if use_keyframes else None,
+                    fused,
+                    video_bounds,
+                )
+            )
+        if not chunk_futures:
+            raise VideoProcessingError("Failed to download video.")
 
-        time.sleep(
-            2
-        )  # Reduced from 4 to 2 seconds to account for more frequent, smaller chunks
+        # Re-assemble the results in chunk order, skipping failed chunks
+        for future in chunk_futures:
+            result = future.result()
+            if result is None:
+                continue
+            summary, intertextual_analysis, video_analysis = result
+            summary_chunks.append(summary)
+            intertextual_chunks.append(intertextual_analysis)
+            video_analyses.append(video_analysis)
 
     return summary_chunks, intertextual_chunks, video_analyses